@@ -0,0 +1,192 @@
+import argparse
+import contextlib
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from dataset import FILES_DIR, load_dataset
+from export import FORMATS, export_results
+from items import item_economics, get_items
+from materials import raw_material_facts
+from sales import SALES_SOURCES, sales_facts
+from variance_analysis import variance_analysis, variance_bridge
+from exchange_vs_price_analysis import exchange_vs_price_analysis
+from production_area_analysis import production_area_analysis, resource_sources
+from raw_materials_variance_analysis import raw_materials_variance_analysis
+from volume_deviation_analysis_per_item import volume_deviation_analysis_per_item
+from volume_deviation_analysis_per_client import volume_deviation_analysis_per_client
+from streaming import CHUNKSIZE, stream_aggregates
+from pipeline import cached_stage
+from profiling import profile, rows, stage, trace_table, write_trace
+
+
+def build_stages(base: str = 'budget', target: str = 'consuntivo') -> dict:
+    # Nome dello step -> (funzione, step da cui dipende).
+    # La funzione riceve i risultati delle dipendenze nello stesso ordine.
+    # base e target sono due scenari qualsiasi (es. forecast e consuntivo): nei nomi delle colonne
+    # dei risultati restano "budget" e "consuntivo".
+    # L'economia per articolo è calcolata una volta per tutti gli scenari: confrontare
+    # un'altra coppia di scenari riusa la stessa tabella (vedi pipeline.cached_stage).
+    # Lo stesso vale per le vendite in euro e per i consumi: gli step che li usano dipendono da
+    # sales_facts e raw_material_facts solo per partire dopo, e li ritrovano già calcolati nella cache
+    return {
+        'sales_facts': (sales_facts, ('dataset',)),
+        'raw_material_facts': (raw_material_facts, ('dataset',)),
+        'item_economics': (lambda dataset, *facts: item_economics(dataset),
+                           ('dataset', 'sales_facts', 'raw_material_facts')),
+        'budget_items': (lambda economics: get_items(economics, base), ('item_economics',)),
+        'final_items': (lambda economics: get_items(economics, target), ('item_economics',)),
+        'variance_bridge': (variance_bridge, ('budget_items', 'final_items')),
+        'scostamento_volume_mix_articolo': (volume_deviation_analysis_per_item, ('dataset', 'budget_items', 'final_items')),
+        'scostamento_prezzo': (lambda dataset, facts: cached_stage(
+            'scostamento_prezzo', dataset, SALES_SOURCES, exchange_vs_price_analysis, base, target),
+            ('dataset', 'sales_facts')),
+        'scostamento_aree': (lambda dataset: cached_stage(
+            'scostamento_aree', dataset, resource_sources(dataset), production_area_analysis, base, target), ('dataset',)),
+        'scostamento_volume_cliente': (lambda dataset, facts: cached_stage(
+            'scostamento_volume_cliente', dataset, SALES_SOURCES, volume_deviation_analysis_per_client, base, target),
+            ('dataset', 'sales_facts')),
+        'scostamento_materie_prime': (lambda dataset, facts: cached_stage(
+            'scostamento_materie_prime', dataset, ('raw_materials_usage',), raw_materials_variance_analysis, base, target),
+            ('dataset', 'raw_material_facts')),
+    }
+
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def _run_stage(name: str, function, *args):
+    with stage(name, 'analysis') as entry:
+        result, elapsed = _timed(function, *args)
+        entry['rows'] = rows(result)
+    return result, elapsed
+
+
+def run_stages(stages: dict, results: dict, workers: int = None, timings: dict = None) -> dict:
+    # Ogni step parte appena le sue dipendenze sono pronte, gli step indipendenti
+    # vengono eseguiti in parallelo (i DataFrame sono condivisi tra i thread, senza copie)
+    pending = dict(stages)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            for name, (function, dependencies) in list(pending.items()):
+                if all(dependency in results for dependency in dependencies):
+                    del pending[name]
+                    # Ogni step gira in una copia del contesto corrente (es. il profiling attivo)
+                    future = executor.submit(
+                        contextvars.copy_context().run, _run_stage, name, function,
+                        *[results[dependency] for dependency in dependencies])
+                    running[future] = name
+
+            if not running:
+                raise ValueError("Dipendenze non risolvibili: " + ", ".join(pending))
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name], elapsed = future.result()
+                if timings is not None:
+                    timings[name] = elapsed
+
+    return results
+
+
+def run_selected(dataset: dict, names: tuple, workers: int = None, timings: dict = None,
+                 base: str = 'budget', target: str = 'consuntivo') -> dict:
+    # Solo gli step richiesti e quelli da cui dipendono (es. la dashboard calcola una sezione alla volta)
+    stages = build_stages(base, target)
+    selected = {}
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name in stages and name not in selected:
+            selected[name] = stages[name]
+            pending.extend(stages[name][1])
+
+    return run_stages(selected, {'dataset': dataset}, workers, timings)
+
+
+def run_analyses(dataset: dict = None, workers: int = None, timings: dict = None,
+                 base: str = 'budget', target: str = 'consuntivo') -> dict:
+    # Tutte le analisi lavorano sugli stessi dati, letti una sola volta, e confrontano
+    # lo scenario base con lo scenario target (di default budget e consuntivo)
+    if timings is None:
+        timings = {}
+
+    if dataset is None:
+        dataset, timings['dataset'] = _timed(load_dataset)
+
+    start = time.perf_counter()
+    results = run_stages(build_stages(base, target), {'dataset': dataset}, workers, timings)
+    timings['totale'] = time.perf_counter() - start + timings.get('dataset', 0)
+
+    scostamento_totale, contributi_articolo = results['variance_bridge']
+    production_areas, scostamento_risorse = results['scostamento_aree']
+
+    return {
+        'scostamento_totale': scostamento_totale,
+        'contributi_articolo': contributi_articolo,
+        'scostamento_prezzo': results['scostamento_prezzo'],
+        'production_areas': production_areas,
+        'scostamento_risorse': scostamento_risorse,
+        'scostamento_volume_mix_articolo': results['scostamento_volume_mix_articolo'],
+        'scostamento_volume_cliente': results['scostamento_volume_cliente'],
+        'scostamento_materie_prime': results['scostamento_materie_prime'],
+    }
+
+
+def run_streaming(path: str = FILES_DIR, chunksize: int = CHUNKSIZE,
+                  base: str = 'budget', target: str = 'consuntivo') -> dict:
+    # Per estrazioni troppo grandi per la memoria: i file vengono letti a blocchi e ridotti
+    # subito agli aggregati per articolo, cliente e area (le analisi di dettaglio non sono disponibili)
+    with stage('stream_aggregates', 'aggregate'):
+        aggregates = stream_aggregates(path, chunksize, base, target)
+    budget_items = aggregates['items'][base]
+    final_items = aggregates['items'][target]
+
+    return {
+        'scostamento_totale': variance_analysis(budget_items=budget_items, final_items=final_items),
+        'scostamento_volume_mix_articolo': volume_deviation_analysis_per_item(
+            budget_items=budget_items, final_items=final_items),
+        'scostamento_volume_cliente': aggregates['scostamento_volume_cliente'],
+        'costo_aree': aggregates['costo_aree'],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analisi degli scostamenti")
+    parser.add_argument("--path", default=FILES_DIR, help="cartella con i file di input")
+    parser.add_argument("--workers", type=int, default=None, help="numero di thread per le analisi")
+    parser.add_argument("--streaming", action="store_true",
+                        help="legge vendite, impiego risorse e consumi a blocchi (memoria limitata)")
+    parser.add_argument("--chunksize", type=int, default=CHUNKSIZE, help="righe per blocco in modalità streaming")
+    parser.add_argument("--format", nargs="+", choices=FORMATS, default=['xlsx'],
+                        help="formati di export: un xlsx per analisi, un unico workbook, parquet, csv")
+    parser.add_argument("--profile", nargs="?", const="export/trace.json", default=None, metavar="FILE",
+                        help="misura tempi, CPU, righe e memoria di ogni step e li salva in un trace JSON")
+    parser.add_argument("--base", default='budget', help="scenario di partenza del confronto (es. budget, forecast 1)")
+    parser.add_argument("--target", default='consuntivo', help="scenario di arrivo del confronto")
+    args = parser.parse_args()
+
+    timings = {}
+    with profile() if args.profile else contextlib.nullcontext() as trace:
+        if args.streaming:
+            start = time.perf_counter()
+            export_results(run_streaming(args.path, args.chunksize, args.base.lower(), args.target.lower()),
+                           formats=args.format)
+            timings['totale'] = time.perf_counter() - start
+        else:
+            dataset, timings['dataset'] = _timed(load_dataset, args.path)
+            export_results(run_analyses(dataset, args.workers, timings, args.base.lower(), args.target.lower()),
+                           formats=args.format)
+
+    for name, elapsed in timings.items():
+        print(f"{name:<35}{elapsed:8.3f} s")
+
+    if args.profile:
+        write_trace(trace, args.profile)
+        print(trace_table(trace).to_string(index=False))
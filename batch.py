@@ -0,0 +1,128 @@
+import argparse
+import contextlib
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from analysis import run_analyses
+from dataset import SOURCES, load_dataset, find_source, read_workbook
+from export import to_table
+from profiling import profile, trace_table, write_trace
+
+BATCH_DIR = "export/batch/"
+
+# Dati di riferimento condivisi da tutti i set di input (stabilimenti/periodi)
+REFERENCE_SOURCES = ('customers', 'exchange_rates')
+
+
+def read_manifest(path: str) -> tuple:
+    # JSON: {"reference": "cartella/", "inputs": [{"entity": ..., "period": ..., "path": ...}, ...]}
+    # oppure direttamente la lista degli input; CSV: colonne entity,period,path.
+    # I percorsi relativi si intendono rispetto alla cartella del manifest.
+    base = os.path.dirname(os.path.abspath(path))
+    reference = None
+
+    if path.lower().endswith('.csv'):
+        with open(path, newline='') as f:
+            inputs = list(csv.DictReader(f))
+    else:
+        with open(path) as f:
+            manifest = json.load(f)
+        if isinstance(manifest, dict):
+            reference = manifest.get('reference')
+            inputs = manifest['inputs']
+        else:
+            inputs = manifest
+
+    for entry in inputs:
+        entry['path'] = os.path.join(base, entry['path'], '')
+    if reference is not None:
+        reference = os.path.join(base, reference, '')
+
+    return inputs, reference
+
+
+def load_reference(path: str) -> dict:
+    # Nome logico -> percorso dei file di riferimento. La conversione in Feather avviene qui una volta sola:
+    # i processi leggono le stesse tabelle dalla cache in memory-map
+    files = {}
+    for name in REFERENCE_SOURCES:
+        files[name] = find_source(path + SOURCES[name])
+        read_workbook(files[name])
+    return files
+
+
+def _to_table(frame: pd.DataFrame, entity: str, period: str) -> pd.DataFrame:
+    # Risultato in forma tabellare con la chiave (entity, period)
+    frame = to_table(frame)
+    frame.insert(0, 'period', str(period))
+    frame.insert(0, 'entity', str(entity))
+    return frame
+
+
+def run_set(entry: dict, reference: dict = None, measure: bool = False) -> tuple:
+    # Con measure viene restituito anche il trace del set (ogni processo misura il proprio)
+    with profile() if measure else contextlib.nullcontext() as trace:
+        dataset = load_dataset(entry['path'], workers=1, files=reference)
+        results = run_analyses(dataset, workers=1)
+    for record in trace or []:
+        record.update(entity=str(entry['entity']), period=str(entry['period']))
+    return {name: _to_table(frame, entry['entity'], entry['period']) for name, frame in results.items()}, trace
+
+
+def run_batch(inputs: list, reference: str = None, workers: int = None, output: str = BATCH_DIR,
+              trace: list = None) -> dict:
+    # Se trace è una lista, viene riempita con i record del profiling di tutti i set
+    files = load_reference(reference) if reference is not None else None
+
+    tables = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_set, entry, files, trace is not None): entry for entry in inputs}
+        for future in as_completed(futures):
+            entry = futures[future]
+            results, records = future.result()
+            for name, table in results.items():
+                tables.setdefault(name, []).append(table)
+            if trace is not None:
+                trace.extend(records)
+            print("Completato: " + str(entry['entity']) + " " + str(entry['period']))
+
+    # Un file Parquet per analisi con tutti i set, ordinato per (entity, period)
+    os.makedirs(output, exist_ok=True)
+    store = {}
+    for name, parts in tables.items():
+        store[name] = pd.concat(parts, ignore_index=True).sort_values(
+            by=['entity', 'period'], kind='stable', ignore_index=True)
+        store[name].to_parquet(output + name + ".parquet", index=False)
+
+    return store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analisi degli scostamenti per più stabilimenti/periodi")
+    parser.add_argument("manifest", help="file JSON o CSV con entity, period e cartella dei file di input")
+    parser.add_argument("--reference", default=None,
+                        help="cartella con Clienti e Tassi di cambio comuni a tutti i set (prevale sul manifest)")
+    parser.add_argument("--workers", type=int, default=None, help="numero di processi")
+    parser.add_argument("--output", default=BATCH_DIR, help="cartella dei risultati Parquet")
+    parser.add_argument("--profile", nargs="?", const="", default=None, metavar="FILE",
+                        help="misura tempi, CPU, righe e memoria di ogni step di ogni set e li salva in un trace JSON "
+                             "(di default trace.json nella cartella di --output)")
+    args = parser.parse_args()
+    if args.profile == "":
+        args.profile = os.path.join(args.output, "trace.json")
+
+    inputs, reference = read_manifest(args.manifest)
+    trace = [] if args.profile else None
+
+    start = time.perf_counter()
+    run_batch(inputs, args.reference or reference, args.workers, os.path.join(args.output, ''), trace)
+    print(f"{len(inputs)} set elaborati in {time.perf_counter() - start:.3f} s")
+
+    if args.profile:
+        write_trace(trace, args.profile)
+        print(trace_table(trace).groupby('kind')[['wall_s', 'cpu_s']].sum().to_string())
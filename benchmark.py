@@ -0,0 +1,145 @@
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from analysis import run_analyses
+from dataset import CACHE_DIR, DERIVED_DIR, cache_file, cached_file_hash, load_dataset
+from exchange_vs_price_analysis import exchange_vs_price_analysis
+from items import item_economics
+from orders import order_facts
+from pipeline import clear_cache
+from production_area_analysis import production_area_analysis
+from profiling import profile, stage, trace_json
+from raw_materials_variance_analysis import raw_materials_variance_analysis
+from synthetic import generate, write
+from variance_analysis import variance_analysis
+from volume_deviation_analysis_per_client import volume_deviation_analysis_per_client
+from volume_deviation_analysis_per_item import volume_deviation_analysis_per_item
+
+BENCH_DIR = CACHE_DIR + "bench/"
+SIZES = (1_000, 10_000, 100_000, 1_000_000)
+
+# Analisi misurate singolarmente (senza risultati in cache, né in memoria né su disco) e la pipeline completa
+ANALYSES = {
+    'item_economics': item_economics,
+    'variance_analysis': variance_analysis,
+    'exchange_vs_price_analysis': exchange_vs_price_analysis,
+    'production_area_analysis': production_area_analysis,
+    'volume_deviation_analysis_per_item': volume_deviation_analysis_per_item,
+    'volume_deviation_analysis_per_client': volume_deviation_analysis_per_client,
+    'raw_materials_variance_analysis': raw_materials_variance_analysis,
+    'order_facts': order_facts,
+    'run_analyses': run_analyses,
+}
+
+# Un tempo oltre questa soglia rispetto alla baseline viene segnalato come regressione
+REGRESSION_THRESHOLD = 1.2
+
+
+def _drop_cache(path: str):
+    # A parità di seed i dati generati sono identici: senza questa pulizia la lettura "a freddo"
+    # troverebbe i file già convertiti da un benchmark precedente (e la cache crescerebbe ad ogni prova)
+    for file in os.listdir(path):
+        cached = cache_file(cached_file_hash(path + file))
+        if os.path.exists(cached):
+            os.remove(cached)
+
+
+def run_size(rows: int, options: dict) -> list:
+    path = BENCH_DIR + str(rows) + "/"
+    shutil.rmtree(path, ignore_errors=True)
+    write(generate(rows, **options), path)
+    _drop_cache(path)
+
+    # Le misure di primo livello hanno kind "benchmark", gli step interni restano nel trace per il dettaglio
+    with profile() as trace:
+        # La prima lettura converte i file nella cache Feather, la seconda la riusa
+        with stage('load_dataset (cold)', 'benchmark'):
+            load_dataset(path, workers=1)
+        with stage('load_dataset', 'benchmark'):
+            dataset = load_dataset(path, workers=1)
+
+        for name, analysis in ANALYSES.items():
+            clear_cache()
+            shutil.rmtree(DERIVED_DIR, ignore_errors=True)
+            with stage(name, 'benchmark') as entry:
+                entry['rows'] = len(dataset['sales'])
+                analysis(dataset)
+
+    _drop_cache(path)
+    shutil.rmtree(path, ignore_errors=True)
+    for record in trace:
+        record['size'] = rows
+    return trace
+
+
+def summary(records: list) -> pd.DataFrame:
+    # Tempo di ogni step per dimensione, con l'esponente di crescita tra le ultime due dimensioni
+    # (1 = lineare, 2 = quadratico): i limiti di scalabilità si vedono da qui
+    table = pd.DataFrame(records)
+    table = table.loc[table['kind'] == 'benchmark']
+    wall = table.pivot_table(index='stage', columns='size', values='wall_s', sort=False)
+    peak = table.pivot_table(index='stage', columns='size', values='peak_mb', sort=False)
+
+    result = wall.add_prefix('s @ ')
+    if wall.shape[1] > 1:
+        sizes = wall.columns[-2:]
+        result['crescita'] = np.log(wall[sizes[1]] / wall[sizes[0]]) / np.log(sizes[1] / sizes[0])
+    result['MB @ ' + str(peak.columns[-1])] = peak[peak.columns[-1]]
+    return result
+
+
+def regressions(records: list, baseline: list, threshold: float = REGRESSION_THRESHOLD) -> pd.DataFrame:
+    # Misure più lente della baseline (stessa analisi e stessa dimensione) oltre la soglia
+    def wall(trace: list) -> pd.Series:
+        table = pd.DataFrame(trace)
+        return table.loc[table['kind'] == 'benchmark'].set_index(['size', 'stage'])['wall_s']
+
+    ratio = (wall(records) / wall(baseline)).dropna()
+    return ratio.loc[ratio > threshold].rename('rapporto').reset_index()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark delle analisi su dati sintetici di dimensione crescente")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES),
+                        help="righe di vendita di ogni prova (fino a 10^7)")
+    parser.add_argument("--items", type=int, default=500)
+    parser.add_argument("--customers", type=int, default=100)
+    parser.add_argument("--currencies", type=int, default=3)
+    parser.add_argument("--areas", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dated-rates", action="store_true",
+                        help="tassi di cambio mensili: le vendite vengono convertite alla data di registrazione")
+    parser.add_argument("--output", default="export/benchmark.json", help="trace JSON con tutte le misure")
+    parser.add_argument("--baseline", default=None, help="trace JSON di un benchmark precedente da confrontare")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="rapporto di tempo oltre il quale una misura è una regressione")
+    args = parser.parse_args()
+
+    options = {'items': args.items, 'customers': args.customers, 'currencies': args.currencies,
+               'areas': args.areas, 'seed': args.seed, 'dated_rates': args.dated_rates}
+
+    records = []
+    for rows in sorted(args.sizes):
+        records.extend(run_size(rows, options))
+        print(f"{rows} righe completate")
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        f.write(trace_json(records))
+
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(summary(records).round(3).to_string())
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            slower = regressions(records, json.load(f)['stages'], args.threshold)
+        if len(slower):
+            print("Regressioni rispetto alla baseline:")
+            print(slower.to_string(index=False))
+        else:
+            print("Nessuna regressione rispetto alla baseline")
@@ -0,0 +1,468 @@
+import glob
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from profiling import stage
+
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+FILES_DIR = "files/"
+CACHE_DIR = ".cache/"
+# Tabelle calcolate a partire dagli input (es. economia per articolo), salvate per impronta
+DERIVED_DIR = CACHE_DIR + "derived/"
+# Limiti della cache: oltre CACHE_BYTES vengono rimossi i file Feather usati meno di recente,
+# l'indice degli hash tiene al più INDEX_SIZE file di input
+CACHE_BYTES = 2 * 1024 ** 3
+INDEX_SIZE = 1000
+# Versione del formato dei file convertiti: cambia quando cambia la conversione (es. colonne categoriche)
+CACHE_FORMAT = 2
+
+# Nome logico -> file sorgente in FILES_DIR
+SOURCES = {
+    'sales': 'Vendite.xlsx',
+    'customers': 'Clienti.xlsx',
+    'exchange_rates': 'Tassi di cambio.xlsx',
+    'resource_usage': 'Impiego orario risorse.xlsx',
+    'budget_costs': 'Costo orario risorse - budget.xlsx',
+    'final_costs': 'Costo orario risorse - consuntivo.xlsx',
+    'raw_materials_usage': 'Consumi.xlsx',
+}
+
+# Costi orari per scenario: oltre a budget e consuntivo vengono letti anche gli altri file
+# "Costo orario risorse - <scenario>" presenti (es. forecast), con nome logico "costs <scenario>"
+COSTS_PREFIX = 'Costo orario risorse - '
+COST_SOURCES = {'budget': 'budget_costs', 'consuntivo': 'final_costs'}
+
+# Colonna che distingue lo scenario (budget, forecast, consuntivo) in ogni sorgente
+SCENARIO_COLUMNS = {
+    'sales': 'budget/cons',
+    'exchange_rates': 'Anno',
+    'resource_usage': 'budget/consuntivo',
+    'raw_materials_usage': 'Budget/cons',
+}
+
+# Chiavi usate nei join tra tabelle diverse: le colonne dello stesso gruppo diventano categoriche
+# con le stesse categorie, così merge e group-by lavorano sui codici interi anziché sulle stringhe
+# (le valute sono già codici interi)
+JOIN_KEYS = {
+    'customer': [('sales', 'Nr. origine'), ('customers', 'Nr.')],
+    'item': [('sales', 'Nr articolo'), ('resource_usage', 'nr articolo'), ('raw_materials_usage', 'Nr articolo')],
+    'resource': [('resource_usage', 'Risorsa')],
+    'area': [('resource_usage', 'Nr. Area di produzione')],
+    'order': [('resource_usage', 'Nr. Ordine di produzione'), ('raw_materials_usage', 'Nr. documento')],
+}
+# Colonne delle tabelle dei costi orari (una per scenario) che si aggiungono ai gruppi di JOIN_KEYS
+COST_JOIN_KEYS = {'resource': 'Risorsa', 'area': 'Area di produzione'}
+
+# Oltre agli xlsx sono accettati anche CSV (formato italiano) e Parquet con lo stesso nome
+EXTENSIONS = ('.xlsx', '.csv', '.parquet')
+CSV_OPTIONS = {'sep': ';', 'decimal': ','}
+
+
+def cost_source(scenario: str) -> str:
+    return COST_SOURCES.get(scenario, 'costs ' + scenario)
+
+
+def cost_sources(dataset: dict) -> dict:
+    # Scenario -> nome logico della tabella dei costi orari
+    sources = {scenario: name for scenario, name in COST_SOURCES.items() if name in dataset}
+    sources.update({name[len('costs '):]: name for name in dataset if name.startswith('costs ')})
+    return sources
+
+
+def file_hash(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def find_source(path: str) -> str:
+    # Se il file xlsx non c'è viene cercato lo stesso file in formato CSV o Parquet
+    stem = os.path.splitext(path)[0]
+    for extension in EXTENSIONS:
+        if os.path.exists(stem + extension):
+            return stem + extension
+    return path
+
+
+def _normalise(frame: pd.DataFrame) -> pd.DataFrame:
+    # Le colonne object con tipi misti (es. codici numerici e testuali) non sono
+    # serializzabili in Arrow: vengono convertite in stringhe mantenendo i NaN
+    for column in frame.columns[frame.dtypes == object]:
+        values = frame[column]
+        if not values.dropna().map(type).eq(str).all():
+            frame[column] = values.where(values.isna(), values.astype(str))
+    return frame
+
+
+def _categorise(frame: pd.DataFrame) -> pd.DataFrame:
+    # Le colonne testuali ripetitive (codici, tipo movimento, descrizione, ...) diventano categoriche
+    # già alla conversione: nella cache Feather restano codificate a dizionario e non vanno
+    # ricodificate ad ogni caricamento
+    for column in frame.columns[frame.dtypes == object]:
+        if frame[column].nunique() <= len(frame) // 2:
+            frame[column] = frame[column].astype('category')
+    return frame
+
+
+def _parse(path: str, data: bytes = None) -> pd.DataFrame:
+    return _categorise(_normalise(_read_source(path, data)))
+
+
+# Lettura e scrittura dell'indice degli hash da più thread (es. le sessioni della dashboard)
+_index_lock = threading.Lock()
+
+
+def _write_atomic(directory: str, target: str, write):
+    # Il file temporaneo ha un nome unico (mkstemp): thread e processi diversi non si sovrascrivono,
+    # e il file completo sostituisce il precedente con un'unica rename
+    handle, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(handle)
+    try:
+        write(tmp)
+        os.replace(tmp, target)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def _load_index() -> dict:
+    try:
+        with open(CACHE_DIR + "index.json") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_index(index: dict):
+    # Tra processi diversi nel peggiore dei casi si perde una voce, che verrà ricalcolata.
+    # Le voci di file non più esistenti vengono tolte, poi restano le INDEX_SIZE aggiornate più di recente
+    index = {path: entry for path, entry in index.items() if os.path.exists(path)}
+    index = dict(list(index.items())[-INDEX_SIZE:])
+
+    def write(tmp):
+        with open(tmp, "w") as f:
+            json.dump(index, f)
+
+    _write_atomic(CACHE_DIR, CACHE_DIR + "index.json", write)
+
+
+def cached_file_hash(path: str) -> str:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+
+    # L'hash del contenuto viene ricalcolato solo se mtime o dimensione del file cambiano
+    stat = os.stat(path)
+    with _index_lock:
+        entry = _load_index().get(os.path.abspath(path))
+    if entry is None or entry['mtime'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+        entry = {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'hash': file_hash(path)}
+        # L'indice viene riletto sotto il lock: le voci aggiunte intanto da altri thread restano
+        with _index_lock:
+            index = _load_index()
+            index.pop(os.path.abspath(path), None)
+            index[os.path.abspath(path)] = entry
+            _save_index(index)
+
+    return entry['hash']
+
+
+def _resolve_sources(path: str, buffers: dict = None, files: dict = None) -> dict:
+    # Nome logico -> (nome del file, contenuto). I file caricati in memoria (nome file -> bytes)
+    # hanno la precedenza su quelli presenti in path, per cui il contenuto è None.
+    # files (nome logico -> percorso) indica singole tabelle da leggere da un'altra cartella
+    # (es. i dati di riferimento comuni di batch.py): come quelle in path passano dalla cache su disco
+    sources = {}
+    for name, file in SOURCES.items():
+        stem = os.path.splitext(file)[0]
+        uploaded = [key for key in (buffers or {}) if os.path.splitext(key)[0] == stem]
+        if uploaded:
+            sources[name] = (uploaded[0], buffers[uploaded[0]])
+        elif name in (files or {}):
+            sources[name] = (find_source(files[name]), None)
+        else:
+            sources[name] = (find_source(path + file), None)
+
+    # Costi orari degli scenari aggiuntivi: con file caricati vengono presi solo tra questi, così un
+    # forecast presente in path non entra nella sessione (né nella sua impronta)
+    extra = {}
+    if buffers:
+        found = list(buffers)
+    else:
+        found = [os.path.basename(file) for file in glob.glob(glob.escape(path + COSTS_PREFIX) + '*')]
+    for file in found:
+        stem, extension = os.path.splitext(file)
+        if not stem.startswith(COSTS_PREFIX) or extension.lower() not in EXTENSIONS:
+            continue
+        name = cost_source(stem[len(COSTS_PREFIX):].strip().lower())
+        if name in sources:
+            continue
+        if file in (buffers or {}):
+            extra[name] = (file, buffers[file])
+        elif name not in extra:
+            extra[name] = (find_source(path + file), None)
+    sources.update(sorted(extra.items()))
+
+    return sources
+
+
+def cost_files(path: str = FILES_DIR) -> dict:
+    # Scenario -> file dei costi orari presenti in path
+    sources = _resolve_sources(path)
+    return {scenario: sources[name][0] for scenario, name in cost_sources(sources).items()}
+
+
+def cache_file(digest: str) -> str:
+    # File Feather della cache per il contenuto con hash digest
+    return CACHE_DIR + digest + ".v" + str(CACHE_FORMAT) + ".feather"
+
+
+def _source_hash(file: str, data: bytes = None) -> str:
+    return cached_file_hash(file) if data is None else hashlib.sha256(data).hexdigest()
+
+
+def fingerprint(path: str = FILES_DIR, buffers: dict = None, files: dict = None) -> str:
+    # Impronta dell'intero set di input: cambia solo se cambia il contenuto di almeno un file
+    sha = hashlib.sha256()
+    for name, (file, data) in _resolve_sources(path, buffers, files).items():
+        sha.update((name + ":" + _source_hash(file, data) + ";").encode())
+    return sha.hexdigest()
+
+
+def _convert_workbook(path: str, cached: str):
+    frame = _parse(path)
+    # Non compresso, così può essere letto in memory-map
+    _write_atomic(os.path.dirname(cached), cached,
+                  lambda tmp: feather.write_feather(frame, tmp, compression='uncompressed'))
+
+
+def _read_cached(cached: str) -> pd.DataFrame:
+    # La data di modifica segna l'ultimo utilizzo, per prune_cache
+    try:
+        os.utime(cached)
+    except OSError:
+        pass
+    return feather.read_table(cached, memory_map=True).to_pandas(split_blocks=True)
+
+
+def prune_cache(max_bytes: int = CACHE_BYTES):
+    # Cache LRU: se i file Feather (input convertiti e tabelle derivate) superano max_bytes
+    # vengono rimossi a partire da quelli usati meno di recente
+    files = []
+    for file in glob.glob(CACHE_DIR + "*.feather") + glob.glob(DERIVED_DIR + "*.feather"):
+        try:
+            stat = os.stat(file)
+        except OSError:
+            continue
+        files.append((stat.st_mtime_ns, stat.st_size, file))
+
+    total = sum(size for _, size, _ in files)
+    for _, size, file in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(file)
+        except OSError:
+            continue
+        total -= size
+
+
+def read_derived(key: str) -> pd.DataFrame:
+    # None se la tabella non è ancora stata calcolata (o se manca pyarrow)
+    cached = DERIVED_DIR + key + ".feather"
+    if feather is None or not os.path.exists(cached):
+        return None
+    return _read_cached(cached)
+
+
+def stored(dataset: dict, sources: tuple) -> bool:
+    # Le tabelle derivate da file caricati nella dashboard non vengono salvate su disco
+    return not any(dataset[source].attrs.get('uploaded') for source in sources)
+
+
+def write_derived(key: str, frame: pd.DataFrame):
+    # Stesso formato della cache degli input: colonnare, non compresso, leggibile in memory-map
+    if feather is None:
+        return
+    os.makedirs(DERIVED_DIR, exist_ok=True)
+    _write_atomic(DERIVED_DIR, DERIVED_DIR + key + ".feather",
+                  lambda tmp: feather.write_feather(frame, tmp, compression='uncompressed'))
+    prune_cache()
+
+
+def _read_source(path: str, data: bytes = None) -> pd.DataFrame:
+    # Con data il file viene letto dalla memoria, path serve solo a riconoscerne il formato
+    source = path if data is None else io.BytesIO(data)
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return pd.read_csv(source, **CSV_OPTIONS)
+    if extension == '.parquet':
+        return pd.read_parquet(source)
+    return pd.read_excel(source, decimal=',')
+
+
+def read_workbook(path: str) -> pd.DataFrame:
+    path = find_source(path)
+    if feather is None:
+        return _parse(path)
+
+    cached = cache_file(cached_file_hash(path))
+    converted = not os.path.exists(cached)
+    if converted:
+        _convert_workbook(path, cached)
+
+    frame = _read_cached(cached)
+    if converted:
+        prune_cache()
+    return frame
+
+
+def load_dataset(path: str = FILES_DIR, workers: int = None, buffers: dict = None, files: dict = None) -> dict:
+    # Ogni file viene letto una sola volta: tutti gli scenari stanno nelle stesse tabelle, distinti
+    # dalla colonna Scenario (vedi filter_scenario)
+    sources = _resolve_sources(path, buffers, files)
+    hashes = {name: _source_hash(file, data) for name, (file, data) in sources.items()}
+
+    if feather is None:
+        # Senza pyarrow i DataFrame tornano dai processi tramite pickle
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            frames = executor.map(_parse, *zip(*sources.values()))
+            dataset = _compact(dict(zip(sources, frames)))
+        return _set_fingerprints(dataset, hashes)
+
+    # I file caricati dalla dashboard restano in memoria: vengono letti senza passare dalla cache su disco
+    uploaded = {name: source for name, source in sources.items() if source[1] is not None}
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    cached = {name: cache_file(hashes[name]) for name in sources if name not in uploaded}
+    # Un solo file da convertire per ogni contenuto distinto
+    missing = {cached[name]: sources[name] for name in cached if not os.path.exists(cached[name])}
+
+    # Il parsing degli xlsx (openpyxl) è CPU-bound: i file mancanti nella cache vengono convertiti
+    # in parallelo e ogni processo restituisce solo il file Feather, che qui viene letto in memory-map.
+    # I file caricati tornano invece dai processi tramite pickle
+    dataset = {}
+    with stage('parse sources', 'load'):
+        if len(missing) + len(uploaded) > 1 and workers != 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                converted = [executor.submit(_convert_workbook, file, target)
+                             for target, (file, _) in missing.items()]
+                parsed = {name: executor.submit(_parse, file, data) for name, (file, data) in uploaded.items()}
+                for future in converted:
+                    future.result()
+                dataset.update({name: future.result() for name, future in parsed.items()})
+        else:
+            for target, (file, _) in missing.items():
+                _convert_workbook(file, target)
+            dataset.update({name: _parse(file, data) for name, (file, data) in uploaded.items()})
+
+    for name in cached:
+        with stage('read ' + name, 'load') as entry:
+            dataset[name] = _read_cached(cached[name])
+            entry['rows'] = len(dataset[name])
+    # Dopo la lettura, che segna i file appena usati: non vengono rimossi prima di essere letti
+    if missing:
+        prune_cache()
+
+    with stage('compact', 'load'):
+        dataset = _compact({name: dataset[name] for name in sources})
+
+    dataset = _set_fingerprints(dataset, hashes)
+    for name in uploaded:
+        dataset[name].attrs['uploaded'] = True
+    return dataset
+
+
+def _lower(values: pd.Series) -> pd.Series:
+    # Per le colonne categoriche basta rinominare le categorie, se restano distinte
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories = values.cat.categories.str.lower()
+        if categories.is_unique:
+            return values.cat.rename_categories(categories)
+    return values.str.lower()
+
+
+def _distinct(values: pd.Series) -> pd.Index:
+    return values.cat.categories if isinstance(values.dtype, pd.CategoricalDtype) else pd.Index(values.unique())
+
+
+def _recode(values: pd.Series, categories: pd.Index):
+    # Le colonne già categoriche (lette dalla cache) vengono solo rimappate sui codici delle nuove
+    # categorie, senza confrontare le stringhe riga per riga
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.set_categories(categories)
+    return pd.Categorical(values, categories=categories)
+
+
+def _compact(dataset: dict) -> dict:
+    # Una sola colonna "Scenario" (categorica, minuscola) al posto dei diversi flag budget/consuntivo,
+    # aggiunta anche alle tabelle dei costi orari: tutte condividono le stesse categorie
+    for name, column in SCENARIO_COLUMNS.items():
+        frame = dataset[name]
+        dataset[name] = frame.drop(columns=column).assign(Scenario=_lower(frame[column]))
+    for scenario, name in cost_sources(dataset).items():
+        dataset[name] = dataset[name].assign(Scenario=scenario)
+
+    join_keys = {key: list(columns) for key, columns in JOIN_KEYS.items()}
+    for name in cost_sources(dataset).values():
+        for key, column in COST_JOIN_KEYS.items():
+            join_keys[key].append((name, column))
+    join_keys['scenario'] = [(name, 'Scenario') for name in SCENARIO_COLUMNS] + \
+        [(name, 'Scenario') for name in cost_sources(dataset).values()]
+
+    # Le categorie comuni si calcolano dalle categorie di ogni colonna, non dalle singole righe
+    for columns in join_keys.values():
+        categories = pd.Index(pd.concat([_distinct(dataset[name][column]).to_series() for name, column in columns]).unique())
+        categories = categories.dropna().sort_values()
+        for name, column in columns:
+            dataset[name][column] = _recode(dataset[name][column], categories)
+
+    return dataset
+
+
+def _set_fingerprints(dataset: dict, hashes: dict) -> dict:
+    # L'hash del file di origine identifica il contenuto di ogni tabella (vedi source_fingerprint)
+    for name, frame in dataset.items():
+        frame.attrs['fingerprint'] = hashes[name]
+    return dataset
+
+
+def source_fingerprint(frame: pd.DataFrame) -> str:
+    # Per le tabelle non lette da file (es. costruite in memoria) l'impronta viene calcolata dal contenuto
+    if 'fingerprint' not in frame.attrs:
+        frame.attrs['fingerprint'] = hashlib.sha256(
+            pd.util.hash_pandas_object(frame, index=False).values.tobytes()).hexdigest()
+    return frame.attrs['fingerprint']
+
+
+def scenario_name(scenario) -> str:
+    # Per compatibilità lo scenario può essere ancora indicato con final (False = budget, True = consuntivo)
+    if isinstance(scenario, bool):
+        return 'consuntivo' if scenario else 'budget'
+    return str(scenario).strip().lower()
+
+
+def scenarios(dataset: dict) -> list:
+    # Scenari presenti nelle vendite: budget per primo, consuntivo per ultimo, gli altri (forecast) in mezzo
+    names = dataset['sales']['Scenario'].dropna().unique()
+    return sorted(names, key=lambda name: (name != 'budget', name == 'consuntivo', name))
+
+
+def resources_cost(dataset: dict) -> pd.DataFrame:
+    # Costi orari di tutti gli scenari in un'unica tabella con la colonna Scenario
+    return pd.concat([dataset[name] for name in cost_sources(dataset).values()], ignore_index=True)
+
+
+def filter_scenario(frame: pd.DataFrame, scenario) -> pd.DataFrame:
+    return frame.loc[frame['Scenario'] == scenario_name(scenario)]
@@ -1,115 +1,103 @@
 import pandas as pd
+from dataset import load_dataset
+from export import export_results
+from sales import AMOUNT, sales_facts, scenario_facts
 
-sales = pd.read_excel("files/Vendite.xlsx", decimal=',')
-exchange_rates = pd.read_excel("files/Tassi di cambio.xlsx", decimal=',')
-customers = pd.read_excel("files/Clienti.xlsx", decimal=',')
 
-# Budget
-budget_exchange_rates = exchange_rates.loc[exchange_rates['Anno'].str.lower(
-) == "budget"]
-budget_sales = sales.loc[(sales['budget/cons'].str.lower() == "budget")]
-
-budget_sales_with_exchange_rates = pd.merge(
-    budget_sales, customers, how="left", left_on='Nr. origine', right_on='Nr.').merge(
-    budget_exchange_rates, how="left", left_on='Valuta', right_on='Codice valuta').rename(
+def _invoices(facts: pd.DataFrame, scenario) -> pd.DataFrame:
+    invoices = scenario_facts(facts, scenario).dropna(subset=['Valuta', 'Tasso di cambio medio']).rename(
         columns={
-            'Importo vendita in valuta locale (TOTALE VENDITA)': 'Prezzo totale fatture (VL)'}
-)[
-    ['Nr. origine',
-     'Nr articolo',
-     'Tasso di cambio medio',
-     'Quantità',
-     'Prezzo totale fatture (VL)',
-     'Valuta']
-].groupby(by=['Nr. origine', 'Valuta', 'Tasso di cambio medio', 'Nr articolo'], as_index=False).sum(numeric_only=True)
+            AMOUNT: 'Prezzo totale fatture (VL)'}
+    )[
+        ['Nr. origine',
+         'Nr articolo',
+         'Tasso di cambio medio',
+         'Quantità',
+         'Prezzo totale fatture (VL)',
+         'Valuta']
+    ]
 
-budget_sales_with_exchange_rates['Prezzo unitario fattura (VL/u)'] = budget_sales_with_exchange_rates['Prezzo totale fatture (VL)'] / \
-    budget_sales_with_exchange_rates['Quantità']
+    invoices['Prezzo unitario fattura (VL/u)'] = invoices['Prezzo totale fatture (VL)'] / \
+        invoices['Quantità']
 
-# Final
-final_exchange_rates = exchange_rates.loc[exchange_rates['Anno'].str.lower(
-) == "consuntivo"]
-final_sales = sales.loc[(sales['budget/cons'].str.lower() == "consuntivo")]
+    return invoices
 
-final_sales_with_exchange_rates = pd.merge(
-    final_sales, customers, how="left", left_on='Nr. origine', right_on='Nr.').merge(
-    final_exchange_rates, how="left", left_on='Valuta', right_on='Codice valuta').rename(
-        columns={
-            'Importo vendita in valuta locale (TOTALE VENDITA)': 'Prezzo totale fatture (VL)'}
-)[
-    ['Nr. origine',
-     'Nr articolo',
-     'Tasso di cambio medio',
-     'Quantità',
-     'Prezzo totale fatture (VL)',
-     'Valuta']
-].groupby(by=['Nr. origine', 'Valuta', 'Tasso di cambio medio', 'Nr articolo'], as_index=False).sum(numeric_only=True)
 
-final_sales_with_exchange_rates['Prezzo unitario fattura (VL/u)'] = final_sales_with_exchange_rates['Prezzo totale fatture (VL)'] / \
-    final_sales_with_exchange_rates['Quantità']
+def exchange_vs_price_analysis(dataset: dict = None, base: str = 'budget', target: str = 'consuntivo') -> pd.DataFrame:
+    if dataset is None:
+        dataset = load_dataset()
+    facts = sales_facts(dataset)
+
+    # Fatture per cliente e articolo di ogni scenario (la tabella dei fatti ha già questa grana)
+    budget_sales_with_exchange_rates = _invoices(facts, base)
+    final_sales_with_exchange_rates = _invoices(facts, target)
+
+    # Actual mix
+    actual_mix = budget_sales_with_exchange_rates[[
+        'Valuta',
+        'Nr. origine',
+        'Nr articolo',
+        'Prezzo unitario fattura (VL/u)',
+        'Tasso di cambio medio']].merge(
+            final_sales_with_exchange_rates[
+                ['Nr. origine',
+                 'Nr articolo',
+                 'Quantità']],
+        how='inner',
+        on=['Nr. origine', 'Nr articolo'])
+    actual_mix['Prezzo totale fattura (€)'] = actual_mix['Prezzo unitario fattura (VL/u)'] / \
+        actual_mix['Tasso di cambio medio'] * actual_mix['Quantità']
+
+    # Actual exchange mix
+    actual_exchange_mix = budget_sales_with_exchange_rates[[
+        'Valuta',
+        'Nr. origine',
+        'Nr articolo',
+        'Prezzo unitario fattura (VL/u)']].merge(
+            final_sales_with_exchange_rates[
+                ['Nr. origine',
+                 'Nr articolo',
+                 'Tasso di cambio medio',
+                 'Quantità']],
+        how='inner',
+        on=['Nr. origine', 'Nr articolo'])
+    actual_exchange_mix['Prezzo totale fattura (€)'] = actual_exchange_mix['Prezzo unitario fattura (VL/u)'] / \
+        actual_exchange_mix['Tasso di cambio medio'] * \
+        actual_exchange_mix['Quantità']
 
-# Actual mix
-actual_mix = budget_sales_with_exchange_rates[[
-    'Valuta',
-    'Nr. origine',
-    'Nr articolo',
-    'Prezzo unitario fattura (VL/u)',
-    'Tasso di cambio medio']].merge(
-        final_sales_with_exchange_rates[
-            ['Nr. origine',
-             'Nr articolo',
-             'Quantità']],
-    how='inner',
-    on=['Nr. origine', 'Nr articolo'])
-actual_mix['Prezzo totale fattura (€)'] = actual_mix['Prezzo unitario fattura (VL/u)'] / \
-    actual_mix['Tasso di cambio medio'] * actual_mix['Quantità']
+    # Final mix
+    final_mix = final_sales_with_exchange_rates[
+        ['Valuta',
+         'Nr. origine',
+         'Nr articolo',
+         'Prezzo unitario fattura (VL/u)',
+         'Tasso di cambio medio',
+         'Quantità']]
+    final_mix['Prezzo totale fattura (€)'] = final_mix['Prezzo unitario fattura (VL/u)'] / \
+        final_mix['Tasso di cambio medio'] * final_mix['Quantità']
 
-# Actual exchange mix
-actual_exchange_mix = budget_sales_with_exchange_rates[[
-    'Valuta',
-    'Nr. origine',
-    'Nr articolo',
-    'Prezzo unitario fattura (VL/u)']].merge(
-        final_sales_with_exchange_rates[
-            ['Nr. origine',
-             'Nr articolo',
-             'Tasso di cambio medio',
-             'Quantità']],
-    how='inner',
-    on=['Nr. origine', 'Nr articolo'])
-actual_exchange_mix['Prezzo totale fattura (€)'] = actual_exchange_mix['Prezzo unitario fattura (VL/u)'] / \
-    actual_exchange_mix['Tasso di cambio medio'] * \
-    actual_exchange_mix['Quantità']
+    scostamento_prezzo = pd.DataFrame({
+        'Mix effettivo': [
+            actual_mix['Prezzo totale fattura (€)'].sum(),
+        ],
+        'Δ Tasso di cambio': [
+            actual_exchange_mix['Prezzo totale fattura (€)'].sum(
+            ) - actual_mix['Prezzo totale fattura (€)'].sum(),
+        ],
+        'Mix tasso effettivo': [
+            actual_exchange_mix['Prezzo totale fattura (€)'].sum()
+        ],
+        'Δ Prezzo': [
+            final_mix['Prezzo totale fattura (€)'].sum(
+            ) - actual_exchange_mix['Prezzo totale fattura (€)'].sum(),
+        ],
+        'Consuntivo': [
+            final_mix['Prezzo totale fattura (€)'].sum(),
+        ],
+    }, index=['Prezzi'])
 
-# Final mix
-final_mix = final_sales_with_exchange_rates[
-    ['Valuta',
-     'Nr. origine',
-     'Nr articolo',
-     'Prezzo unitario fattura (VL/u)',
-     'Tasso di cambio medio',
-     'Quantità']]
-final_mix['Prezzo totale fattura (€)'] = final_mix['Prezzo unitario fattura (VL/u)'] / \
-    final_mix['Tasso di cambio medio'] * final_mix['Quantità']
+    return scostamento_prezzo
 
-scostamento_prezzo = pd.DataFrame({
-    'Mix effettivo': [
-        actual_mix['Prezzo totale fattura (€)'].sum(),
-    ],
-    'Δ Tasso di cambio': [
-        actual_exchange_mix['Prezzo totale fattura (€)'].sum(
-        ) - actual_mix['Prezzo totale fattura (€)'].sum(),
-    ],
-    'Mix tasso effettivo': [
-        actual_exchange_mix['Prezzo totale fattura (€)'].sum()
-    ],
-    'Δ Prezzo': [
-        final_mix['Prezzo totale fattura (€)'].sum(
-        ) - actual_exchange_mix['Prezzo totale fattura (€)'].sum(),
-    ],
-    'Consuntivo': [
-        final_mix['Prezzo totale fattura (€)'].sum(),
-    ],
-}, index=['Prezzi'])
 
-scostamento_prezzo.to_excel("export/scostamento_prezzo.xlsx")
+if __name__ == "__main__":
+    export_results({'scostamento_prezzo': exchange_vs_price_analysis()})
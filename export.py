@@ -0,0 +1,100 @@
+import os
+
+import pandas as pd
+
+from dataset import CSV_OPTIONS
+from profiling import stage
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+EXPORT_DIR = "export/"
+WORKBOOK = "analisi.xlsx"
+
+# xlsx: un file per analisi, workbook: tutte le analisi in un unico file (un foglio per analisi),
+# parquet/csv: tabelle semplici per i sistemi a valle che non usano Excel
+FORMATS = ('xlsx', 'workbook', 'parquet', 'csv')
+
+# Righe convertite per volta: in constant_memory ogni riga viene scritta su disco appena completa
+CHUNKSIZE = 10_000
+
+
+def _records(frame: pd.DataFrame) -> list:
+    # Valori Python (NaN -> cella vuota) riga per riga
+    return frame.astype(object).where(frame.notna(), None).to_numpy().tolist()
+
+
+def _write_sheet(workbook, name: str, frame: pd.DataFrame):
+    # Stessa disposizione di DataFrame.to_excel (indice nelle prime colonne, una riga di intestazione
+    # per livello delle colonne), ma scritta per righe: xlsxwriter in constant_memory
+    # non tiene in memoria il foglio, mentre Pandas scrive colonna per colonna
+    worksheet = workbook.add_worksheet(name[:31])
+    bold = workbook.add_format({'bold': True})
+    index = frame.index.to_frame(index=False)
+    levels = frame.columns.nlevels
+
+    for level in range(levels):
+        labels = [None if pd.isna(label) else str(label) for label in frame.columns.get_level_values(level)]
+        names = [None] * index.shape[1] if level < levels - 1 else \
+            [None if name is None else str(name) for name in frame.index.names]
+        worksheet.write_row(level, 0, names + labels, bold)
+
+    for start in range(0, len(frame), CHUNKSIZE):
+        rows = zip(_records(index.iloc[start:start + CHUNKSIZE]), _records(frame.iloc[start:start + CHUNKSIZE]))
+        for row, (index_values, values) in enumerate(rows, start=levels + start):
+            worksheet.write_row(row, 0, index_values + values)
+
+
+def write_xlsx(results: dict, file: str):
+    # Tutte le tabelle di results in un solo workbook, un foglio per chiave, in un solo passaggio
+    if xlsxwriter is None:
+        with pd.ExcelWriter(file) as writer:
+            for name, frame in results.items():
+                frame.to_excel(writer, sheet_name=name[:31])
+        return
+
+    workbook = xlsxwriter.Workbook(file, {'constant_memory': True, 'strings_to_numbers': False,
+                                          'strings_to_formulas': False, 'strings_to_urls': False})
+    try:
+        for name, frame in results.items():
+            _write_sheet(workbook, name, frame)
+    finally:
+        workbook.close()
+
+
+def to_table(frame: pd.DataFrame) -> pd.DataFrame:
+    # Risultato in forma tabellare (colonne semplici, indice come colonna, niente categorie)
+    frame = frame.copy()
+    if isinstance(frame.columns, pd.MultiIndex):
+        frame.columns = [' | '.join(column) for column in frame.columns]
+    if not isinstance(frame.index, pd.RangeIndex):
+        frame = frame.rename_axis(frame.index.name or 'Voce').reset_index()
+    for column in frame.columns[frame.dtypes == 'category']:
+        frame[column] = frame[column].astype(object)
+    return frame
+
+
+def export_results(results: dict, path: str = EXPORT_DIR, formats: tuple = ('xlsx',)):
+    os.makedirs(path, exist_ok=True)
+    for export_format in formats:
+        if export_format not in FORMATS:
+            raise ValueError("Formato di export non supportato: " + export_format)
+
+        if export_format == 'workbook':
+            with stage(WORKBOOK, 'export') as entry:
+                write_xlsx(results, path + WORKBOOK)
+                entry['rows'] = sum(len(frame) for frame in results.values())
+            continue
+
+        for name, frame in results.items():
+            with stage(name + "." + export_format, 'export') as entry:
+                if export_format == 'xlsx':
+                    # Un file xlsx per ogni analisi, con lo stesso nome della chiave
+                    write_xlsx({name: frame}, path + name + ".xlsx")
+                elif export_format == 'parquet':
+                    to_table(frame).to_parquet(path + name + ".parquet", index=False)
+                else:
+                    to_table(frame).to_csv(path + name + ".csv", index=False, **CSV_OPTIONS)
+                entry['rows'] = len(frame)
@@ -1,10 +1,19 @@
+import contextlib
+import threading
+
 import streamlit as st
 import pandas as pd
 import plotly.express as px
 import numpy as np
 
 # Variance analysis script
-from variance_analysis import variance_analysis
+from analysis import run_analyses, run_selected
+from dataset import fingerprint, load_dataset, scenarios
+from export import export_results
+from items import item_economics, item_lookup
+from orders import order_facts, worst_orders
+from production_area_analysis import area_names
+import profiling
 
 # module 'numpy' has no attribute 'bool8'
 np.bool = np.bool_
@@ -23,20 +32,267 @@ with st.expander("Scopri di più"):
     Il codice è disponibile su [Github](https://github.com/zanottipaolo/SCG-project).
 
     Presi in input i dati dell'azienda (i nostri o quelli caricati dall'utente) viene eseguito uno script Python che, tramite Pandas,
-    crea dei file XLSX contenenti tutti gli elementi utili per l'analisi degli scostamenti. Questi file vengono poi elaborati tramite
-    Streamlit per estrapolare le informazioni più importanti da visualizzare qui nel sito.
+    calcola tutti gli elementi utili per l'analisi degli scostamenti. I risultati vengono poi elaborati tramite
+    Streamlit per estrapolare le informazioni più importanti da visualizzare qui nel sito (e salvati in background come file XLSX).
     ''')
 
-DATA_URL = ('export/scostamento_totale.xlsx')
-data = None
+
+active_input = None
+trace = None
+# Il pannello "Performance" (in fondo alla pagina) misura analisi e rendering solo se richiesto
+measure = st.session_state.get('profile', False)
 result = False
 uploaded_files = []
 missing_files = []
 
-# All'inizio carica i nostri dati. 
-# Se l'utente vuole visualizzare i suoi dati allora può caricarli dalla sidebar.
-variance_analysis()
-data = pd.read_excel(DATA_URL)
+# Sezione della dashboard -> step dell'analisi (vedi analysis.build_stages) da cui prende i dati
+SECTIONS = {
+    "Scostamento volume": 'scostamento_volume_mix_articolo',
+    "Scostamento MIX": 'scostamento_volume_mix_articolo',
+    "Scostamento prezzo": 'scostamento_prezzo',
+    "Scostamento costi": 'scostamento_aree',
+    "Scostamento materie prime": 'scostamento_materie_prime',
+}
+
+
+# I dati di input vengono letti una volta per impronta e condivisi (in sola lettura) da tutte le sezioni.
+# I file caricati restano in memoria nella sessione dell'utente (_buffers, escluso dalla chiave della cache):
+# sessioni diverse non si sovrascrivono i dati, e chi carica gli stessi file riusa lo stesso risultato.
+@st.cache_resource(max_entries=4, show_spinner="Caricamento dati...")
+def get_dataset(input_fingerprint: str, _buffers: dict = None) -> dict:
+    return load_dataset(buffers=_buffers)
+
+
+# Streamlit riesegue lo script ad ogni interazione: ogni sezione calcola solo lo step che mostra
+# (con quelli da cui dipende), una volta per impronta dei dati e coppia di scenari
+@st.cache_data(max_entries=32, show_spinner="Analisi in corso...")
+def get_result(input_fingerprint: str, name: str, base: str = 'budget', target: str = 'consuntivo',
+               measure: bool = False, _buffers: dict = None) -> tuple:
+    # Con measure viene restituito anche il trace, caricamento dei dati compreso
+    with profiling.profile() if measure else contextlib.nullcontext() as trace:
+        dataset = load_dataset(buffers=_buffers) if measure else get_dataset(input_fingerprint, _buffers)
+        result = run_selected(dataset, (name,), base=base, target=target)[name]
+    return result, trace
+
+
+@st.cache_data(max_entries=8)
+def get_scenarios(input_fingerprint: str, _buffers: dict = None) -> list:
+    return scenarios(get_dataset(input_fingerprint, _buffers))
+
+
+# Tabella indicizzata (scenario, articolo) per il dettaglio del singolo articolo: un oggetto condiviso
+# in sola lettura, senza copiarlo ad ogni esecuzione dello script
+@st.cache_resource(max_entries=8)
+def get_item_economics(input_fingerprint: str, _buffers: dict = None) -> pd.DataFrame:
+    return item_economics(get_dataset(input_fingerprint, _buffers))
+
+
+# Ordini di produzione indicizzati per articolo e per area: i dettagli leggono solo un intervallo dell'indice
+@st.cache_resource(max_entries=8)
+def get_order_facts(input_fingerprint: str, _buffers: dict = None) -> tuple:
+    return order_facts(get_dataset(input_fingerprint, _buffers))
+
+
+@st.cache_data(max_entries=8)
+def get_area_names(input_fingerprint: str, _buffers: dict = None) -> pd.Series:
+    return area_names(get_dataset(input_fingerprint, _buffers))
+
+
+# I file in export/ (condivisi) vengono aggiornati solo con i nostri dati e con il confronto
+# budget/consuntivo: una volta per impronta, in background e dopo il rendering della pagina
+@st.cache_resource(max_entries=1)
+def export_in_background(input_fingerprint: str) -> threading.Thread:
+    dataset = get_dataset(input_fingerprint)
+    thread = threading.Thread(target=lambda: export_results(run_analyses(dataset)), daemon=True)
+    thread.start()
+    return thread
+
+
+def select_scenarios(input_scenarios: list) -> tuple:
+    # Con due scenari si confrontano quelli presenti nei dati (es. forecast e consuntivo), già ordinati
+    # da dataset.scenarios; con più di due l'utente sceglie quali confrontare
+    if len(input_scenarios) < 2:
+        return 'budget', 'consuntivo'
+    if len(input_scenarios) == 2:
+        return input_scenarios[0], input_scenarios[-1]
+
+    st.subheader('Confronto scenari :left_right_arrow:')
+    base = st.selectbox("Scenario di partenza", input_scenarios, index=0, key="base")
+    target = st.selectbox("Scenario di arrivo", input_scenarios, index=len(input_scenarios) - 1, key="target")
+    return base, target
+
+
+def share_pie(labels: pd.Series, values: pd.Series, names: str, value: str, title: str, others: str,
+              textinfo: str) -> tuple:
+    # Tabella completa e torta in cui le voci sotto l'1% del totale sono raggruppate in "others"
+    table = pd.DataFrame({
+        names: labels.astype(str).values,
+        value: values.values,
+    })
+
+    grouped = table.copy()
+    grouped.loc[(grouped[value] * 100) / grouped[value].sum() < 1, names] = others
+    fig = px.pie(grouped, values=value, names=names, title=title)
+    fig.update_traces(textposition='inside', textinfo=textinfo)
+
+    return table.set_index(names), fig
+
+
+def horizontal_figure(data: pd.DataFrame):
+    scostamento_totale = pd.DataFrame({
+        "Scostamento":
+            data.index.values,
+        "Budget":
+            data["Budget"].values,
+        "Mix standard":
+            data["Mix standard"].values,
+        "Mix effettivo":
+            data["Mix effettivo"].values,
+        "Consuntivo":
+            data["Consuntivo"].values
+    }).transpose()
+
+    # serve per usare la prima riga come intestazione della tabella
+    scostamento_totale.columns = scostamento_totale.iloc[0]
+    scostamento_totale = scostamento_totale[1:]
+    scostamento_totale.drop('Costi MP', inplace=True, axis=1)
+    scostamento_totale.drop('Costi risorse', inplace=True, axis=1)
+
+    # Per il grafico non si riusciva ad usare i dati nel formato Wide di Plotly, allora tramite la funzione "melt()"
+    # di Pandas sono stati trasformati nel formato Long
+    scostamento_totale = scostamento_totale.reset_index()
+    scostamento_totale = pd.melt(scostamento_totale, id_vars=[
+        'index'], var_name='Scostamenti', value_name='value')
+    return px.bar(
+        scostamento_totale, x="index", y="value", color="Scostamenti", barmode="group", labels={
+    "index": "",
+    "value": "€"
+}, text_auto=True)
+
+
+def volume_figures(temp_scostamento_volume_per_articolo: pd.DataFrame) -> dict:
+    return {
+        'budget': share_pie(temp_scostamento_volume_per_articolo['Nr articolo'],
+                            temp_scostamento_volume_per_articolo['Quantità budget'], 'Articolo', 'qta budget',
+                            "Articoli a budget", 'Altri articoli', 'value+label'),
+        'consuntivo': share_pie(temp_scostamento_volume_per_articolo['Nr articolo'],
+                                temp_scostamento_volume_per_articolo['Quantità consuntivo'], 'Articolo',
+                                'qta consuntivo', "Articoli a consuntivo", 'Altri articoli', 'value+label'),
+    }
+
+
+def mix_figures(temp_scostamento_mix_per_articolo: pd.DataFrame) -> dict:
+    return {
+        'budget': share_pie(temp_scostamento_mix_per_articolo['Nr articolo'],
+                            temp_scostamento_mix_per_articolo['Mix budget (%)'], 'Articolo', 'MIX budget',
+                            "Articoli a budget", 'Altri articoli', 'percent+label'),
+        'consuntivo': share_pie(temp_scostamento_mix_per_articolo['Nr articolo'],
+                                temp_scostamento_mix_per_articolo['Mix consuntivo (%)'], 'Articolo',
+                                'MIX consuntivo', "Articoli a consuntivo", 'Altri articoli', 'percent+label'),
+    }
+
+
+def price_figures(temp_scostamento_prezzo: pd.DataFrame) -> dict:
+    scostamento_prezzo = temp_scostamento_prezzo.transpose()
+    scostamento_prezzo.drop("Δ Tasso di cambio", inplace=True, axis=0)
+    scostamento_prezzo.drop("Δ Prezzo", inplace=True, axis=0)
+
+    # TODO: dividere per valuta
+    return {
+        'prezzo': px.bar(
+            scostamento_prezzo.reset_index(), x="index", y="Prezzi", labels={
+        "index": "",
+        "Prezzi": "Prezzi (€)"
+    }, text_auto=True),
+    }
+
+
+def resource_figure(temp_scostamento_area: pd.DataFrame) -> tuple:
+    temp_scostamento_area = temp_scostamento_area.iloc[:, 1:]
+
+    scostamento_area = pd.DataFrame(
+        {
+            "Risorsa":
+                temp_scostamento_area["Risorsa"].values,
+            "Costo budget":
+                temp_scostamento_area["Costo budget"].values,
+            "Costo ore effettive":
+                temp_scostamento_area["Costo ore effettive"].values,
+            "Costo consuntivo":
+                temp_scostamento_area["Costo consuntivo"].values,
+        }
+    ).transpose()
+
+    scostamento_area.columns = scostamento_area.iloc[0]
+    scostamento_area = scostamento_area[1:]
+
+    scostamento_area = scostamento_area.reset_index()
+    scostamento_area = pd.melt(scostamento_area, id_vars=[
+                               'index'], var_name='risorse', value_name='value')
+    return temp_scostamento_area.set_index("Risorsa"), px.bar(
+        scostamento_area, x="index", y="value", color="risorse", barmode="group", labels={
+    "index": "",
+    "value": "€"
+})
+
+
+def cost_figures(aree: tuple) -> dict:
+    temp_scostamento_costo_aree = aree[0]
+    return {
+        'budget': share_pie(temp_scostamento_costo_aree['Area di produzione'],
+                            temp_scostamento_costo_aree['Costo (€) budget'], 'Area di prduzione',
+                            'Costo (€) budget', "Impiego risorse nelle aree - budget", 'Altre aree',
+                            'percent+label'),
+        'consuntivo': share_pie(temp_scostamento_costo_aree['Area di produzione'],
+                                temp_scostamento_costo_aree['Costo (€) consuntivo'], 'Area di prduzione',
+                                'Costo (€) consuntivo', "Impiego risorse nelle aree - consuntivo", 'Altre aree',
+                                'percent+label'),
+    }
+
+
+def materials_figures(temp_scostamento_materie_prime: pd.DataFrame) -> dict:
+    totali = temp_scostamento_materie_prime[['Costo budget', 'Δ quantità', 'Δ prezzo unitario', 'Costo consuntivo']].sum()
+
+    # Materie prime (per articolo) con lo scostamento più alto in valore assoluto
+    scostamento = temp_scostamento_materie_prime['Costo consuntivo'] - temp_scostamento_materie_prime['Costo budget']
+    return {
+        'materie_prime': px.bar(
+            totali.rename('Costo MP (€)').reset_index(), x="index", y="Costo MP (€)", labels={
+        "index": "",
+    }, text_auto=True),
+        'principali': temp_scostamento_materie_prime.loc[scostamento.abs().nlargest(10).index].set_index('Codice MP'),
+    }
+
+
+FIGURES = {
+    "Risultati": horizontal_figure,
+    "Scostamento volume": volume_figures,
+    "Scostamento MIX": mix_figures,
+    "Scostamento prezzo": price_figures,
+    "Scostamento costi": cost_figures,
+    "Scostamento materie prime": materials_figures,
+}
+
+
+# I grafici di una sezione vengono costruiti solo quando la sezione è visibile, poi riusati
+# finché non cambiano dati o scenari (input_key)
+@st.cache_resource(max_entries=32)
+def get_figures(input_key: tuple, section: str, _data):
+    return FIGURES[section](_data)
+
+
+# Le righe di ogni area in un solo group-by, dall'area con il costo a consuntivo più alto
+@st.cache_resource(max_entries=8)
+def get_resource_areas(input_key: tuple, _scostamento_risorse: pd.DataFrame) -> dict:
+    areas = dict(tuple(_scostamento_risorse.groupby('Area di produzione', observed=True, sort=False)))
+    return dict(sorted(areas.items(), key=lambda area: area[1]['Costo consuntivo'].sum(), reverse=True))
+
+
+# Il grafico di un'area viene costruito solo quando l'area viene scelta, poi riusato
+@st.cache_resource(max_entries=256)
+def get_resource_figure(input_key: tuple, area: str, _scostamento_area: pd.DataFrame) -> tuple:
+    return resource_figure(_scostamento_area)
+
 
 # Upload files
 with st.sidebar:
@@ -63,461 +319,173 @@ with st.sidebar:
         for missing_file in missing_files:
             st.text(missing_file)
     else:
-        # Save file
-        for uploaded_file in uploaded_files:
-            f = open("files/" + uploaded_file.name, "wb")
-            f.write(uploaded_file.read())
-            f.close()
+        # I file non vengono salvati su disco: il contenuto passa direttamente all'analisi
+        buffers = {uploaded_file.name: uploaded_file.getvalue() for uploaded_file in uploaded_files}
+        uploads_fingerprint = fingerprint(buffers=buffers)
 
         # Ri-esegue lo script con i nuovi dati dell'utente
         try:
-            variance_analysis()
-            data = pd.read_excel(DATA_URL)
-            st.success("Script eseguito correttamente", icon="✅")
-            st.balloons()
+            input_scenarios = get_scenarios(uploads_fingerprint, buffers)
+            base, target = select_scenarios(input_scenarios)
+            bridge, trace = get_result(uploads_fingerprint, 'variance_bridge', base, target, measure, buffers)
+            active_input = (uploads_fingerprint, buffers)
+            if st.session_state.get('uploads_fingerprint') != uploads_fingerprint:
+                st.session_state['uploads_fingerprint'] = uploads_fingerprint
+                st.success("Script eseguito correttamente", icon="✅")
+                st.balloons()
         except:
             st.error("L'esecuzione dello script è fallita! Verifica i file caricati.", icon="⚠️")
 
+    # All'inizio carica i nostri dati.
+    # Se l'utente vuole visualizzare i suoi dati allora può caricarli dalla sidebar.
+    if active_input is None:
+        input_fingerprint = fingerprint()
+        base, target = select_scenarios(get_scenarios(input_fingerprint))
+        bridge, trace = get_result(input_fingerprint, 'variance_bridge', base, target, measure)
+        active_input = (input_fingerprint, None)
+
+# Solo il resoconto viene calcolato prima di mostrare la pagina, il resto dipende dalla sezione scelta
+data = bridge[0]
+input_key = (active_input[0], base, target)
+
+render_trace = profiling.start_trace() if measure else None
+
 st.write("#")
 
 # Resoconto analisi scostamento
 st.subheader('Risultati a consuntivo :dart:')
 
 if st.checkbox("Mostra tutti i dati", key="scostamento_totale"):
-    st.dataframe(data.set_index("Unnamed: 0").style.format(thousands="˙", decimal=",",
+    st.dataframe(data.style.format(thousands="˙", decimal=",",
                                     precision="2"), use_container_width=True)
 
-st.metric("MOL", f"€ {data['Consuntivo'][4]:,.2f}".replace(",", " ").replace(".", ","), "{:,.2f}".format(
-    data['Consuntivo'][4] - data['Budget'][4]).replace(",", " ").replace(".", ","))
+st.metric("MOL", f"€ {data['Consuntivo']['MOL']:,.2f}".replace(",", " ").replace(".", ","), "{:,.2f}".format(
+    data['Consuntivo']['MOL'] - data['Budget']['MOL']).replace(",", " ").replace(".", ","))
 
 col1, col2, col3 = st.columns(3)
-col1.metric("Ricavi", f"€ {data['Consuntivo'][0]:,.2f}".replace(",", " ").replace(
-    ".", ","), "{:,.2f}".format(data['Consuntivo'][0] - data['Budget'][0]).replace(",", " ").replace(".", ","))
-col2.metric("Costi MP", f"€ {data['Consuntivo'][2]:,.2f}".replace(",", " ").replace(
-    ".", ","), "{:,.2f}".format(data['Consuntivo'][2] - data['Budget'][2]).replace(",", " ").replace(".", ","))
-col3.metric("Costi risorse", f"€ {data['Consuntivo'][3]:,.2f}".replace(",", " ").replace(
-    ".", ","), "{:,.2f}".format(data['Consuntivo'][3] - data['Budget'][3]).replace(",", " ").replace(".", ","))
+col1.metric("Ricavi", f"€ {data['Consuntivo']['Ricavi']:,.2f}".replace(",", " ").replace(
+    ".", ","), "{:,.2f}".format(data['Consuntivo']['Ricavi'] - data['Budget']['Ricavi']).replace(",", " ").replace(".", ","))
+col2.metric("Costi MP", f"€ {data['Consuntivo']['Costi MP']:,.2f}".replace(",", " ").replace(
+    ".", ","), "{:,.2f}".format(data['Consuntivo']['Costi MP'] - data['Budget']['Costi MP']).replace(",", " ").replace(".", ","))
+col3.metric("Costi risorse", f"€ {data['Consuntivo']['Costi risorse']:,.2f}".replace(",", " ").replace(
+    ".", ","), "{:,.2f}".format(data['Consuntivo']['Costi risorse'] - data['Budget']['Costi risorse']).replace(",", " ").replace(".", ","))
+
+profiling.lap('render risultati')
 
 st.write("#")
 
 # Analisi orizzontale
 st.subheader("Scostamenti orizzontali :left_right_arrow:")
 
-scostamento_totale = pd.DataFrame({
-    "Scostamento":
-        data["Unnamed: 0"].values,
-    "Budget":
-        data["Budget"].values,
-    "Mix standard":
-        data["Mix standard"].values,
-    "Mix effettivo":
-        data["Mix effettivo"].values,
-    "Consuntivo":
-        data["Consuntivo"].values
-}).transpose()
-
-# serve per usare la prima riga come intestazione della tabella
-scostamento_totale.columns = scostamento_totale.iloc[0]
-scostamento_totale = scostamento_totale[1:]
-scostamento_totale.drop('Costi MP', inplace=True, axis=1)
-scostamento_totale.drop('Costi risorse', inplace=True, axis=1)
-
-# Per il grafico non si riusciva ad usare i dati nel formato Wide di Plotly, allora tramite la funzione "melt()" 
-# di Pandas sono stati trasformati nel formato Long
-scostamento_totale = scostamento_totale.reset_index()
-scostamento_totale = pd.melt(scostamento_totale, id_vars=[
-    'index'], var_name='Scostamenti', value_name='value')
-chart_scostamento_totale = px.bar(
-    scostamento_totale, x="index", y="value", color="Scostamenti", barmode="group", labels={
-"index": "",
-"value": "€"
-}, text_auto=True)
-st.plotly_chart(chart_scostamento_totale,
+st.plotly_chart(get_figures(input_key, "Risultati", data),
                 theme="streamlit", use_container_width=True)
 
+profiling.lap('render scostamenti orizzontali')
+
 st.write("#")
 
-# Analisi verticale
+# Analisi verticale: viene calcolata e disegnata solo la sezione scelta
 st.subheader("Scostamenti verticali :arrow_up_down:")
-tab1, tab2, tab3, tab4 = st.tabs(
-    ["Scostamento volume", "Scostamento MIX", "Scostamento prezzo", "Scostamento costi"])
+section = st.radio("Sezione", list(SECTIONS), horizontal=True, key="section", label_visibility="collapsed")
+section_data, section_trace = get_result(active_input[0], SECTIONS[section], base, target, measure, active_input[1])
+figures = get_figures(input_key, section, section_data)
 
-# Scostamento volume
-with tab1:
-    temp_scostamento_volume_per_articolo = pd.read_excel(
-        "export/scostamento_volume_mix_articolo.xlsx")
+if section in ("Scostamento volume", "Scostamento MIX"):
+    # volume e MIX hanno la stessa struttura: torta a budget e a consuntivo
+    prefix = "volume" if section == "Scostamento volume" else "mix"
 
     col1, col2 = st.columns(2)
-    with col1:
-        # budget
-        scostamento_volume_per_articolo_budget = pd.DataFrame({
-            'Articolo':
-                temp_scostamento_volume_per_articolo['Nr articolo'].values,
-            'qta budget':
-                temp_scostamento_volume_per_articolo['Quantità budget'].values,
-        })
-
-        if st.checkbox("Mostra tutti i dati", key="volume_budget"):
-            st.dataframe(scostamento_volume_per_articolo_budget.set_index("Articolo"))
-
-        # mostra solo gli articoli maggiori dell'1% rispetto al totale
-        scostamento_volume_per_articolo_budget.loc[(scostamento_volume_per_articolo_budget['qta budget'] * 100) /
-                                                    scostamento_volume_per_articolo_budget['qta budget'].sum() < 1, 'Articolo'] = 'Altri articoli'
-        fig_volume_budget = px.pie(scostamento_volume_per_articolo_budget,
-                                    values="qta budget", names="Articolo", title="Articoli a budget")
-        fig_volume_budget.update_traces(
-            textposition='inside', textinfo='value+label')
-
-        st.plotly_chart(fig_volume_budget, theme="streamlit",
-                        use_container_width=True)
-
-    with col2:
-        # consuntivo
-        scostamento_volume_per_articolo_consuntivo = pd.DataFrame({
-            'Articolo':
-                temp_scostamento_volume_per_articolo['Nr articolo'].values,
-            'qta consuntivo':
-                temp_scostamento_volume_per_articolo['Quantità consuntivo'].values,
-        })
-
-        if st.checkbox("Mostra tutti i dati", key="volume_consuntivo"):
-            st.dataframe(scostamento_volume_per_articolo_consuntivo.set_index("Articolo"))
-
-        scostamento_volume_per_articolo_consuntivo.loc[(scostamento_volume_per_articolo_consuntivo['qta consuntivo'] * 100) /
-                                                        scostamento_volume_per_articolo_consuntivo['qta consuntivo'].sum() < 1, 'Articolo'] = 'Altri articoli'
-        fig_volume_consuntivo = px.pie(scostamento_volume_per_articolo_consuntivo,
-                                        values="qta consuntivo", names="Articolo", title="Articoli a consuntivo")
-        fig_volume_consuntivo.update_traces(
-            textposition='inside', textinfo='value+label')
-
-        st.plotly_chart(fig_volume_consuntivo,
-                        theme="streamlit", use_container_width=True)
-
-# Scostamento MIX
-with tab2:
-    temp_scostamento_mix_per_articolo = pd.read_excel(
-        "export/scostamento_volume_mix_articolo.xlsx")
-
-    col1, col2 = st.columns(2)
-    with col1:
-        # budget
-        scostamento_mix_per_articolo_budget = pd.DataFrame({
-            'Articolo':
-                temp_scostamento_mix_per_articolo['Nr articolo'].values,
-            'MIX budget':
-                temp_scostamento_mix_per_articolo['Mix budget (%)'].values,
-        })
-
-        if st.checkbox("Mostra tutti i dati", key="mix_budget"):
-            st.dataframe(scostamento_mix_per_articolo_budget.set_index("Articolo"))
-
-        # mostra solo gli articoli maggiori dell'1% rispetto al totale
-        scostamento_mix_per_articolo_budget.loc[(scostamento_mix_per_articolo_budget['MIX budget'] * 100) /
-                                                scostamento_mix_per_articolo_budget['MIX budget'].sum() < 1, 'Articolo'] = 'Altri articoli'
-        fig_mix_budget = px.pie(scostamento_mix_per_articolo_budget,
-                                values="MIX budget", names="Articolo", title="Articoli a budget")
-        fig_mix_budget.update_traces(
-            textposition='inside', textinfo='percent+label')
-
-        st.plotly_chart(fig_mix_budget, theme="streamlit",
-                        use_container_width=True)
-
-    with col2:
-        # consuntivo
-        scostamento_mix_per_articolo_consuntivo = pd.DataFrame({
-            'Articolo':
-                temp_scostamento_mix_per_articolo['Nr articolo'].values,
-            'MIX consuntivo':
-                temp_scostamento_mix_per_articolo['Mix consuntivo (%)'].values,
-        })
-
-        if st.checkbox("Mostra tutti i dati", key="mix_consuntivo"):
-            st.dataframe(scostamento_mix_per_articolo_consuntivo.set_index("Articolo"))
-
-        scostamento_mix_per_articolo_consuntivo.loc[(scostamento_mix_per_articolo_consuntivo['MIX consuntivo'] * 100) /
-                                                    scostamento_mix_per_articolo_consuntivo['MIX consuntivo'].sum() < 1, 'Articolo'] = 'Altri articoli'
-        fig_mix_consuntivo = px.pie(scostamento_mix_per_articolo_consuntivo,
-                                    values="MIX consuntivo", names="Articolo", title="Articoli a consuntivo")
-        fig_mix_consuntivo.update_traces(
-            textposition='inside', textinfo='percent+label')
-
-        st.plotly_chart(fig_mix_consuntivo, theme="streamlit",
-                        use_container_width=True)
-
-# Scostamento prezzo
-with tab3:
-    temp_scostamento_prezzo = pd.read_excel(
-        "export/scostamento_prezzo.xlsx")
-
-    scostamento_prezzo = temp_scostamento_prezzo.transpose()
-    scostamento_prezzo.columns = scostamento_prezzo.iloc[0]
-    scostamento_prezzo = scostamento_prezzo[1:]
-    scostamento_prezzo.drop("Δ Tasso di cambio", inplace=True, axis=0)
-    scostamento_prezzo.drop("Δ Prezzo", inplace=True, axis=0)
-
-    # TODO: dividere per valuta
-    chart_scostamento_prezzo = px.bar(
-        scostamento_prezzo.reset_index(), x="index", y="Prezzi", labels={
-    "index": "",
-    "Prezzi": "Prezzi (€)"
-}, text_auto=True)
-    st.plotly_chart(chart_scostamento_prezzo,
+    for column, scenario in ((col1, 'budget'), (col2, 'consuntivo')):
+        with column:
+            table, fig = figures[scenario]
+            if st.checkbox("Mostra tutti i dati", key=prefix + "_" + scenario):
+                st.dataframe(table)
+
+            st.plotly_chart(fig, theme="streamlit", use_container_width=True)
+
+    if section == "Scostamento volume":
+        # Dettaglio di un articolo: lettura diretta dall'indice (scenario, articolo)
+        economics = get_item_economics(*active_input)
+        item = st.selectbox("Dettaglio articolo", economics.index.unique(level='Nr articolo').astype(str),
+                            key="item_detail")
+        st.dataframe(pd.DataFrame({
+            scenario: item_lookup(economics, scenario, item)
+            for scenario in (base, target) if (scenario, item) in economics.index
+        }))
+
+        st.caption("Ordini di produzione con lo scostamento più alto rispetto al costo unitario " + base +
+                   " (senza ordini " + base + " l'articolo non ha un costo standard)")
+        st.dataframe(worst_orders(get_order_facts(*active_input), base, target, item=item).set_index(
+            "Nr. Ordine di produzione"), use_container_width=True)
+
+elif section == "Scostamento prezzo":
+    st.plotly_chart(figures['prezzo'],
                     theme="streamlit", use_container_width=True)
 
-    st.dataframe(temp_scostamento_prezzo.set_index('Unnamed: 0').style.format(
+    st.dataframe(section_data.style.format(
         thousands="˙", decimal=",", precision="2"), use_container_width=True)
 
-# Scostamento costo
-with tab4:
-    temp_scostamento_costo_aree = pd.read_excel(
-        "export/production_areas.xlsx")
-    temp_scostamento_costo_aree.drop('Unnamed: 0', inplace=True, axis=1)
-
-    if st.checkbox("Mostra tutti i dati", key="costo_aree"):
-        st.dataframe(temp_scostamento_costo_aree.set_index("Area di produzione").style.format(
-            thousands="˙", decimal=",", precision="2"))
-
-    col1, col2 = st.columns(2)
-    with col1:
-        # budget
-        scostamento_costo_aree_budget = pd.DataFrame({
-            'Area di prduzione':
-                temp_scostamento_costo_aree['Area di produzione'].values,
-            'Costo (€) budget':
-                temp_scostamento_costo_aree['Costo (€) budget'].values,
-        })
-
-        scostamento_costo_aree_budget.loc[(scostamento_costo_aree_budget['Costo (€) budget'] * 100) /
-                                            scostamento_costo_aree_budget['Costo (€) budget'].sum() < 1, 'Area di prduzione'] = 'Altre aree'
-        fig_costo_aree_budget = px.pie(scostamento_costo_aree_budget, values="Costo (€) budget",
-                                        names="Area di prduzione", title="Impiego risorse nelle aree - budget")
-        fig_costo_aree_budget.update_traces(
-            textposition='inside', textinfo='percent+label')
-
-        st.plotly_chart(fig_costo_aree_budget,
-                        theme="streamlit", use_container_width=True)
-
-    with col2:
-        # consuntivo
-        scostamento_costo_aree_consuntivo = pd.DataFrame({
-            'Area di prduzione':
-                temp_scostamento_costo_aree['Area di produzione'].values,
-            'Costo (€) consuntivo':
-                temp_scostamento_costo_aree['Costo (€) consuntivo'].values,
-        })
-
-        scostamento_costo_aree_consuntivo.loc[(scostamento_costo_aree_consuntivo['Costo (€) consuntivo'] * 100) /
-                                                scostamento_costo_aree_consuntivo['Costo (€) consuntivo'].sum() < 1, 'Area di prduzione'] = 'Altre aree'
-        fig_costo_aree_consuntivo = px.pie(scostamento_costo_aree_consuntivo, values="Costo (€) consuntivo",
-                                            names="Area di prduzione", title="Impiego risorse nelle aree - consuntivo")
-        fig_costo_aree_consuntivo.update_traces(
-            textposition='inside', textinfo='percent+label')
-
-        st.plotly_chart(fig_costo_aree_consuntivo,
-                        theme="streamlit", use_container_width=True)
-
-    # Focus risorse
-    st.subheader("Focus risorse")
-    temp_scostamento_risorse = pd.read_excel(
-        "export/scostamento_risorse.xlsx")
-
-    # tornitura (A20)
-    st.caption("Tornitura (A20)")
-    area = "A20"
-    temp_scostamento_tornitura = temp_scostamento_risorse.query(
-        "(`Area di produzione` == @area)"
-    )
-
-    temp_scostamento_tornitura = temp_scostamento_tornitura.iloc[:, 2:]
-
-    if st.checkbox("Mostra tutti i dati", key="risorsa_tornitura"):
-        st.dataframe(temp_scostamento_tornitura.set_index("Risorsa").style.format(
-            thousands="˙", decimal=",", precision="2"), use_container_width=True)
-
-    scostamento_tornitura = pd.DataFrame(
-        {
-            "Risorsa":
-                temp_scostamento_tornitura["Risorsa"].values,
-            "Costo budget":
-                temp_scostamento_tornitura["Costo budget"].values,
-            "Costo ore effettive":
-                temp_scostamento_tornitura["Costo ore effettive"].values,
-            "Costo consuntivo":
-                temp_scostamento_tornitura["Costo consuntivo"].values,
-        }
-    ).transpose()
-
-    scostamento_tornitura.columns = scostamento_tornitura.iloc[0]
-    scostamento_tornitura = scostamento_tornitura[1:]
-
-    scostamento_tornitura = scostamento_tornitura.reset_index()
-    scostamento_tornitura = pd.melt(scostamento_tornitura, id_vars=[
-                                    'index'], var_name='risorse', value_name='value')
-    chart_scostamento_tornitura = px.bar(
-        scostamento_tornitura, x="index", y="value", color="risorse", barmode="group", labels={
-    "index": "",
-    "value": "€"
-})
-    st.plotly_chart(chart_scostamento_tornitura,
+elif section == "Scostamento materie prime":
+    # Scostamento dei consumi diviso in quantità (al prezzo budget) e prezzo unitario
+    st.plotly_chart(figures['materie_prime'],
                     theme="streamlit", use_container_width=True)
 
-    # fresatura (A30)
-    st.caption("Fresatura (A30)")
-    area = "A30"
-    temp_scostamento_fresatura = temp_scostamento_risorse.query(
-        "(`Area di produzione` == @area)"
-    )
-
-    temp_scostamento_fresatura = temp_scostamento_fresatura.iloc[:, 2:]
-
-    if st.checkbox("Mostra tutti i dati", key="risorsa_fresatura"):
-        st.dataframe(temp_scostamento_fresatura.set_index("Risorsa").style.format(
+    if st.checkbox("Mostra tutti i dati", key="materie_prime"):
+        st.dataframe(section_data.set_index('Codice MP').style.format(
             thousands="˙", decimal=",", precision="2"), use_container_width=True)
-
-    scostamento_fresatura = pd.DataFrame(
-        {
-            "Risorsa":
-                temp_scostamento_fresatura["Risorsa"].values,
-            "Costo budget":
-                temp_scostamento_fresatura["Costo budget"].values,
-            "Costo ore effettive":
-                temp_scostamento_fresatura["Costo ore effettive"].values,
-            "Costo consuntivo":
-                temp_scostamento_fresatura["Costo consuntivo"].values,
-        }
-    ).transpose()
-
-    scostamento_fresatura.columns = scostamento_fresatura.iloc[0]
-
-    scostamento_fresatura = scostamento_fresatura[1:]
-
-    scostamento_fresatura = scostamento_fresatura.reset_index()
-    scostamento_fresatura = pd.melt(scostamento_fresatura, id_vars=[
-                                    'index'], var_name='risorse', value_name='value')
-    chart_scostamento_fresatura = px.bar(
-        scostamento_fresatura, x="index", y="value", color="risorse", barmode="group", labels={
-    "index": "",
-    "value": "€"
-})
-    st.plotly_chart(chart_scostamento_fresatura,
-                    theme="streamlit", use_container_width=True)
-
-    # montaggio (A40)
-    st.caption("Montaggio (A40)")
-    area = "A40"
-    temp_scostamento_montaggio = temp_scostamento_risorse.query(
-        "(`Area di produzione` == @area)"
-    )
-
-    temp_scostamento_montaggio = temp_scostamento_montaggio.iloc[:, 2:]
-
-    if st.checkbox("Mostra tutti i dati", key="risorsa_montaggio"):
-        st.dataframe(temp_scostamento_montaggio.set_index("Risorsa").style.format(
+    else:
+        st.caption("Materie prime con lo scostamento più alto")
+        st.dataframe(figures['principali'].style.format(
             thousands="˙", decimal=",", precision="2"), use_container_width=True)
 
-    scostamento_montaggio = pd.DataFrame(
-        {
-            "Risorsa":
-                temp_scostamento_montaggio["Risorsa"].values,
-            "Costo budget":
-                temp_scostamento_montaggio["Costo budget"].values,
-            "Costo ore effettive":
-                temp_scostamento_montaggio["Costo ore effettive"].values,
-            "Costo consuntivo":
-                temp_scostamento_montaggio["Costo consuntivo"].values,
-        }
-    ).transpose()
-
-    scostamento_montaggio.columns = scostamento_montaggio.iloc[0]
-    scostamento_montaggio = scostamento_montaggio[1:]
-
-    scostamento_montaggio = scostamento_montaggio.reset_index()
-    scostamento_montaggio = pd.melt(scostamento_montaggio, id_vars=[
-                                    'index'], var_name='risorse', value_name='value')
-    chart_scostamento_montaggio = px.bar(
-        scostamento_montaggio, x="index", y="value", color="risorse", barmode="group", labels={
-    "index": "",
-    "value": "€"
-})
-    st.plotly_chart(chart_scostamento_montaggio,
-                    theme="streamlit", use_container_width=True)
+else:
+    temp_scostamento_costo_aree = section_data[0]
 
-    # saldatura (A11)
-    st.caption("Saldatura (A11)")
-    area = "A11"
-    temp_scostamento_saldatura = temp_scostamento_risorse.query(
-        "(`Area di produzione` == @area)"
-    )
+    if st.checkbox("Mostra tutti i dati", key="costo_aree"):
+        st.dataframe(temp_scostamento_costo_aree.set_index("Area di produzione").style.format(
+            thousands="˙", decimal=",", precision="2"))
 
-    temp_scostamento_saldatura = temp_scostamento_saldatura.iloc[:, 2:]
+    col1, col2 = st.columns(2)
+    for column, scenario in ((col1, 'budget'), (col2, 'consuntivo')):
+        with column:
+            st.plotly_chart(figures[scenario][1],
+                            theme="streamlit", use_container_width=True)
 
-    if st.checkbox("Mostra tutti i dati", key="risorsa_saldatura"):
-        st.dataframe(temp_scostamento_saldatura.set_index("Risorsa").style.format(
+    # Focus risorse: tutte le aree presenti nei dati, una alla volta
+    st.subheader("Focus risorse")
+    resource_areas = get_resource_areas(input_key, section_data[1])
+    names = get_area_names(*active_input)
+    labels = {f"{names[area]} ({area})" if area in names.index else str(area): area for area in resource_areas}
+    area = labels[st.selectbox("Area di produzione", list(labels), key="focus_area")]
+    table, fig = get_resource_figure(input_key, area, resource_areas[area])
+
+    if st.checkbox("Mostra tutti i dati", key="risorse_area"):
+        st.dataframe(table.style.format(
             thousands="˙", decimal=",", precision="2"), use_container_width=True)
 
-    scostamento_saldatura = pd.DataFrame(
-        {
-            "Risorsa":
-                temp_scostamento_saldatura["Risorsa"].values,
-            "Costo budget":
-                temp_scostamento_saldatura["Costo budget"].values,
-            "Costo ore effettive":
-                temp_scostamento_saldatura["Costo ore effettive"].values,
-            "Costo consuntivo":
-                temp_scostamento_saldatura["Costo consuntivo"].values,
-        }
-    ).transpose()
-
-    scostamento_saldatura.columns = scostamento_saldatura.iloc[0]
-    scostamento_saldatura = scostamento_saldatura[1:]
-
-    scostamento_saldatura = scostamento_saldatura.reset_index()
-    scostamento_saldatura = pd.melt(scostamento_saldatura, id_vars=[
-                                    'index'], var_name='risorse', value_name='value')
-    chart_scostamento_saldatura = px.bar(
-        scostamento_saldatura, x="index", y="value", color="risorse", barmode="group", labels={
-    "index": "",
-    "value": "€"
-})
-    st.plotly_chart(chart_scostamento_saldatura,
+    st.plotly_chart(fig,
                     theme="streamlit", use_container_width=True)
 
-    # pre. materiale (A10)
-    st.caption("Prep. materiale/Taglio/ Sbavatura (A10)")
-    area = "A10"
-    temp_scostamento_preparazione = temp_scostamento_risorse.query(
-        "(`Area di produzione` == @area)"
-    )
+    st.caption("Ordini di produzione con lo scostamento più alto nell'area rispetto al costo unitario " + base +
+               " (esclusi gli articoli senza ordini " + base + " nell'area)")
+    st.dataframe(worst_orders(get_order_facts(*active_input), base, target, area=area).set_index(
+        "Nr. Ordine di produzione"), use_container_width=True)
 
-    temp_scostamento_preparazione = temp_scostamento_preparazione.iloc[:, 2:]
+profiling.lap('render ' + section)
 
-    if st.checkbox("Mostra tutti i dati", key="risorsa_preparazione"):
-        st.dataframe(temp_scostamento_preparazione.set_index("Risorsa").style.format(
-            thousands="˙", decimal=",", precision="2"), use_container_width=True)
+st.write("#")
 
-    scostamento_preparazione = pd.DataFrame(
-        {
-            "Risorsa":
-                temp_scostamento_preparazione["Risorsa"].values,
-            "Costo budget":
-                temp_scostamento_preparazione["Costo budget"].values,
-            "Costo ore effettive":
-                temp_scostamento_preparazione["Costo ore effettive"].values,
-            "Costo consuntivo":
-                temp_scostamento_preparazione["Costo consuntivo"].values,
-        }
-    ).transpose()
+st.checkbox("Misura le prestazioni", key="profile",
+            help="Tempo, CPU, righe e memoria di ogni step di caricamento, analisi e rendering")
+if render_trace is not None:
+    profiling.stop_trace(render_trace)
 
-    scostamento_preparazione.columns = scostamento_preparazione.iloc[0]
-    scostamento_preparazione = scostamento_preparazione[1:]
+    with st.expander("Performance", expanded=True):
+        # Il trace delle analisi è quello del calcolo memorizzato in cache (se i dati non cambiano non viene rieseguito)
+        records = (trace or []) + (section_trace or []) + render_trace
+        st.dataframe(profiling.trace_table(records), use_container_width=True)
+        st.download_button("Scarica il trace JSON", profiling.trace_json(records),
+                           file_name="trace.json", mime="application/json")
 
-    scostamento_preparazione = scostamento_preparazione.reset_index()
-    scostamento_preparazione = pd.melt(scostamento_preparazione, id_vars=[
-        'index'], var_name='risorse', value_name='value')
-    chart_scostamento_preparazione = px.bar(
-        scostamento_preparazione, x="index", y="value", color="risorse", barmode="group", labels={
-    "index": "",
-    "value": "€"
-})
-    st.plotly_chart(chart_scostamento_preparazione,
-                    theme="streamlit", use_container_width=True)
+if active_input[1] is None and (base, target) == ('budget', 'consuntivo'):
+    export_in_background(active_input[0])
@@ -1,71 +1,95 @@
-import pandas as pd
-
+import hashlib
 
-def getItem(final: bool) -> pd.DataFrame:
-    filter = 'consuntivo' if final else 'budget'
+import pandas as pd
 
-    sales = pd.read_excel("files/Vendite.xlsx", decimal=',')
-    customers = pd.read_excel("files/Clienti.xlsx", decimal=',')
-    exchange_rates = pd.read_excel("files/Tassi di cambio.xlsx", decimal=',')
-    resource_usage = pd.read_excel(
-        "files/Impiego orario risorse.xlsx", decimal=',')
-    resources_cost = pd.read_excel(
-        "files/Costo orario risorse - " + filter + ".xlsx", decimal=',')
-    raw_materials_usage = pd.read_excel("files/Consumi.xlsx", decimal=',')
+from dataset import load_dataset, scenario_name, cost_sources, resources_cost, source_fingerprint, \
+    read_derived, stored, write_derived
+from pipeline import cached_stage
+from profiling import stage
+from materials import raw_material_facts
+from sales import SALES_SOURCES, sales_facts
 
-    # Sales
-    exchange_rates = exchange_rates.loc[exchange_rates['Anno'].str.lower(
-    ) == filter]
-    sales = sales.loc[(sales['budget/cons'].str.lower() == filter)]
+# Fa parte della chiave della tabella salvata in .cache: va incrementata quando cambia il calcolo,
+# così le tabelle salvate con la versione precedente non vengono più lette
+ITEM_ECONOMICS_VERSION = 3
 
-    sales_with_exchange_rates = pd.merge(
-        sales, customers, how="left", left_on='Nr. origine', right_on='Nr.').merge(
-        exchange_rates, how="left", left_on='Valuta', right_on='Codice valuta')
 
-    sales_with_exchange_rates['Prezzo (€)'] = sales_with_exchange_rates[
-        'Importo vendita in valuta locale (TOTALE VENDITA)'] / sales_with_exchange_rates['Tasso di cambio medio']
+def _sales_per_item(dataset: dict) -> pd.DataFrame:
+    facts = sales_facts(dataset)
 
-    sales_groupped_by_item = sales_with_exchange_rates.groupby(by=[
-        "Nr articolo"], as_index=False).sum(numeric_only=True)
+    with stage('sales_per_item', 'aggregate') as entry:
+        sales_groupped_by_item = facts.groupby(by=[
+            "Scenario", "Nr articolo"], as_index=False, observed=True)[['Quantità', 'Prezzo (€)']].sum()
+        entry['rows'] = len(sales_groupped_by_item)
 
     sales_groupped_by_item['Prezzo unitario (€/u)'] = sales_groupped_by_item['Prezzo (€)'] / \
         sales_groupped_by_item['Quantità']
 
+    # Il mix è calcolato sul volume totale di ogni scenario
     sales_groupped_by_item['Mix (%)'] = sales_groupped_by_item['Quantità'] / \
-        sales_groupped_by_item['Quantità'].sum(numeric_only=True)
+        sales_groupped_by_item.groupby('Scenario', observed=True)['Quantità'].transform('sum')
 
-    # Costs
+    return sales_groupped_by_item
+
+
+def _resource_cost_per_item(dataset: dict) -> pd.DataFrame:
+    resource_usage = dataset['resource_usage']
+
+    with stage('resource_cost_per_item', 'merge') as entry:
+        resource_usage_with_cost = resource_usage.merge(resources_cost(dataset), how="left", left_on=[
+            'Scenario', 'Risorsa', 'Nr. Area di produzione'], right_on=['Scenario', 'Risorsa', 'Area di produzione'])
+        resource_usage_with_cost['Costo risorse (€)'] = resource_usage_with_cost['Tempo risorsa'] * \
+            resource_usage_with_cost['Costo orario (€/h)']
+        entry['rows'] = len(resource_usage_with_cost)
 
-    # Resources cost
-    resource_usage = resource_usage.loc[resource_usage['budget/consuntivo'].str.lower(
-    ) == filter]
-    production_volume = resource_usage['Quantità di output'].sum()
+    with stage('resource_cost_per_item', 'aggregate') as entry:
+        resource_cost_per_item = resource_usage_with_cost.groupby(
+            by=["Scenario", "nr articolo"], observed=True).sum(numeric_only=True)
+        entry['rows'] = len(resource_cost_per_item)
 
-    resource_usage_with_cost = resource_usage.merge(resources_cost, how="left", left_on=[
-        'Risorsa', 'Nr. Area di produzione'], right_on=['Risorsa', 'Area di produzione'])
-    resource_usage_with_cost['Costo risorse (€)'] = resource_usage_with_cost['Tempo risorsa'] * \
-        resource_usage_with_cost['Costo orario (€/h)']
+    return resource_cost_per_item
 
-    resource_cost_per_item = resource_usage_with_cost.groupby(
-        by=["nr articolo"]).sum(numeric_only=True)
 
-    # print(resource_cost_per_item)
+def _raw_materials_cost_per_item(dataset: dict) -> pd.DataFrame:
+    facts = raw_material_facts(dataset)
 
-    # Raw materials cost
-    raw_materials_usage = raw_materials_usage.loc[(
-        raw_materials_usage['Budget/cons'].str.lower() == filter)]
+    with stage('raw_materials_cost_per_item', 'aggregate') as entry:
+        raw_materials_cost = facts.groupby(
+            by=["Scenario", "Nr articolo"], as_index=False, observed=True)[['Costo MP (€)']].sum()
+        entry['rows'] = len(raw_materials_cost)
 
-    raw_materials_cost = raw_materials_usage.groupby(
-        by=["Nr articolo"], as_index=False).sum(numeric_only=True).rename(columns={"Importo costo (TOTALE)": "Costo MP (€)"})[['Nr articolo', 'Costo MP (€)']]
+    return raw_materials_cost
 
+
+def _item_economics(dataset: dict) -> pd.DataFrame:
+    # Ogni ramo viene ricalcolato solo se cambiano le tabelle da cui dipende
+    # (es. un nuovo file di tassi di cambio ricalcola solo le vendite)
+    sales_groupped_by_item = cached_stage(
+        'sales_per_item', dataset, SALES_SOURCES, _sales_per_item)
+    resource_cost_per_item = cached_stage(
+        'resource_cost_per_item', dataset, ('resource_usage',) + tuple(cost_sources(dataset).values()),
+        _resource_cost_per_item).reset_index()
+    raw_materials_cost = cached_stage(
+        'raw_materials_cost_per_item', dataset, ('raw_materials_usage',), _raw_materials_cost_per_item)
+
+    with stage('item_economics', 'merge') as entry:
+        item = _combine(sales_groupped_by_item, resource_cost_per_item, raw_materials_cost)
+        entry['rows'] = len(item)
+
+    return item
+
+
+def _combine(sales_groupped_by_item: pd.DataFrame, resource_cost_per_item: pd.DataFrame,
+             raw_materials_cost: pd.DataFrame) -> pd.DataFrame:
+    # Costs
     item_cost = resource_cost_per_item.merge(
-        raw_materials_cost, how="left", left_on=['nr articolo'], right_on=['Nr articolo'])
+        raw_materials_cost, how="left", left_on=['Scenario', 'nr articolo'], right_on=['Scenario', 'Nr articolo'])
 
     item_cost['Costo totale (€)'] = item_cost['Costo MP (€)'] + \
         item_cost['Costo risorse (€)']
 
     item_cost = item_cost.merge(sales_groupped_by_item[[
-        'Nr articolo', 'Quantità']], how="left", on=['Nr articolo'])
+        'Scenario', 'Nr articolo', 'Quantità']], how="left", on=['Scenario', 'Nr articolo'])
 
     item_cost['Costo unitario (€/u)'] = item_cost['Costo totale (€)'] / \
         item_cost['Quantità']
@@ -76,7 +100,53 @@ def getItem(final: bool) -> pd.DataFrame:
 
     # All together
     item = sales_groupped_by_item.merge(
-        item_cost[['Nr articolo', 'Costo unitario (€/u)', 'Costo unitario MP (€/u)', 'Costo unitario risorse (€/u)']], how="left", on=['Nr articolo'])
+        item_cost[['Scenario', 'Nr articolo', 'Costo unitario (€/u)', 'Costo unitario MP (€/u)', 'Costo unitario risorse (€/u)']], how="left", on=['Scenario', 'Nr articolo'])
 
-    return item[['Nr articolo', 'Quantità',
+    return item[['Scenario', 'Nr articolo', 'Quantità',
                  'Prezzo unitario (€/u)', 'Costo unitario (€/u)', 'Costo unitario MP (€/u)', 'Costo unitario risorse (€/u)', 'Mix (%)']]
+
+
+def _item_sources(dataset: dict) -> tuple:
+    return SALES_SOURCES + ('resource_usage', 'raw_materials_usage') + tuple(cost_sources(dataset).values())
+
+
+def _stored_item_economics(dataset: dict) -> pd.DataFrame:
+    # La tabella viene salvata su disco con l'impronta delle sorgenti: con gli stessi file di input
+    # (anche in un altro processo o dopo un riavvio della dashboard) viene solo riletta
+    sha = hashlib.sha256(str(ITEM_ECONOMICS_VERSION).encode())
+    for source in _item_sources(dataset):
+        sha.update((source + ":" + source_fingerprint(dataset[source]) + ";").encode())
+    key = "item_economics-" + sha.hexdigest()
+
+    economics = read_derived(key)
+    if economics is None:
+        economics = _item_economics(dataset)
+        if stored(dataset, _item_sources(dataset)):
+            write_derived(key, economics)
+
+    return economics.set_index(['Scenario', 'Nr articolo']).sort_index()
+
+
+def item_economics(dataset: dict = None) -> pd.DataFrame:
+    # Economia per articolo di tutti gli scenari (budget, forecast, consuntivo) in un solo passaggio,
+    # indicizzata su (Scenario, Nr articolo): il confronto tra due scenari qualsiasi e le ricerche
+    # per articolo partono da questa tabella, senza ricalcoli
+    if dataset is None:
+        dataset = load_dataset()
+
+    return cached_stage('item_economics', dataset, _item_sources(dataset), _stored_item_economics)
+
+
+def get_items(economics: pd.DataFrame, scenario) -> pd.DataFrame:
+    # Articoli di un solo scenario, nello stesso formato di getItem()
+    return economics.xs(scenario_name(scenario), level='Scenario').reset_index()
+
+
+def item_lookup(economics: pd.DataFrame, scenario, item: str) -> pd.Series:
+    # Valori di un articolo in uno scenario: lettura diretta sull'indice
+    return economics.loc[(scenario_name(scenario), item)]
+
+
+def getItem(final, dataset: dict = None) -> pd.DataFrame:
+    # final: True/False per consuntivo/budget, oppure il nome di uno scenario (es. 'forecast 1')
+    return get_items(item_economics(dataset), final)
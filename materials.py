@@ -0,0 +1,27 @@
+import pandas as pd
+
+from dataset import load_dataset
+from pipeline import cached_stage
+from profiling import stage
+
+# Grana della tabella dei consumi: il costo MP per articolo e lo scostamento per materia prima
+# partono dallo stesso group-by
+MATERIAL_KEYS = ['Scenario', 'Nr articolo', 'Codice MP']
+
+
+def _raw_material_facts(dataset: dict) -> pd.DataFrame:
+    with stage('raw_material_facts', 'aggregate') as entry:
+        facts = dataset['raw_materials_usage'].groupby(by=MATERIAL_KEYS, observed=True, dropna=False)[
+            ['Quantità MP impiegata', 'Importo costo (TOTALE)']].sum().reset_index().rename(
+            columns={'Importo costo (TOTALE)': 'Costo MP (€)'})
+        entry['rows'] = len(facts)
+
+    return facts
+
+
+def raw_material_facts(dataset: dict = None) -> pd.DataFrame:
+    # Quantità e costo di ogni materia prima per articolo e scenario, in un solo passaggio sui consumi
+    if dataset is None:
+        dataset = load_dataset()
+
+    return cached_stage('raw_material_facts', dataset, ('raw_materials_usage',), _raw_material_facts)
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+
+from dataset import load_dataset, scenario_name, cost_sources, resources_cost
+from pipeline import cached_stage
+from profiling import stage
+
+ORDER = 'Nr. Ordine di produzione'
+
+# Indici delle tabelle: per articolo (ordini di un articolo) e per area (ordini che hanno lavorato nell'area)
+ORDER_INDEX = ['Scenario', 'Nr articolo', ORDER]
+AREA_INDEX = ['Scenario', 'Area di produzione', 'Nr articolo', ORDER]
+RESOURCE_INDEX = AREA_INDEX + ['Risorsa']
+
+# Ordini mostrati di default nel dettaglio
+TOP_ORDERS = 10
+
+
+def _order_sources(dataset: dict) -> tuple:
+    return ('resource_usage', 'raw_materials_usage') + tuple(cost_sources(dataset).values())
+
+
+def _sorted(frame: pd.DataFrame, keys: list) -> pd.DataFrame:
+    # Con chiavi categoriche e observed=True il group-by non restituisce i gruppi ordinati:
+    # sort_values sulle colonne ordina sui codici delle categorie, molto più veloce di sort_index sul MultiIndex
+    return frame.sort_values(keys, kind='stable', ignore_index=True).set_index(keys)
+
+
+def _order_facts(dataset: dict) -> tuple:
+    # Un solo passaggio su impiego risorse e consumi per tutti gli scenari
+    with stage('order_facts', 'aggregate') as entry:
+        # La quantità di output è ripetuta su ogni fase dell'ordine: si tiene la massima, non la somma
+        resources = dataset['resource_usage'].groupby(
+            by=['Scenario', 'Nr. Area di produzione', 'nr articolo', ORDER, 'Risorsa'], observed=True).agg(**{
+                'Tempo risorsa': ('Tempo risorsa', 'sum'),
+                'Quantità di output': ('Quantità di output', 'max'),
+            }).reset_index().rename(columns={'Nr. Area di produzione': 'Area di produzione', 'nr articolo': 'Nr articolo'})
+
+        materials = dataset['raw_materials_usage'].groupby(
+            by=['Scenario', 'Nr articolo', 'Nr. documento'], observed=True, as_index=False)[
+            ['Quantità MP impiegata', 'Importo costo (TOTALE)']].sum().rename(
+            columns={'Importo costo (TOTALE)': 'Costo MP (€)', 'Nr. documento': ORDER})
+        entry['rows'] = len(resources) + len(materials)
+
+    with stage('order_facts', 'merge') as entry:
+        resources = resources.merge(resources_cost(dataset), how='left', on=['Scenario', 'Risorsa', 'Area di produzione'])
+        resources['Costo risorse (€)'] = resources['Tempo risorsa'] * resources['Costo orario (€/h)']
+
+        orders = resources.groupby(by=ORDER_INDEX, observed=True, as_index=False).agg(**{
+            'Quantità di output': ('Quantità di output', 'max'),
+            'Tempo risorsa': ('Tempo risorsa', 'sum'),
+            'Costo risorse (€)': ('Costo risorse (€)', 'sum'),
+        })
+        # Ordini con sole risorse o soli consumi: merge outer sulle colonne, non join tra due MultiIndex
+        orders = orders.merge(materials, how='outer', on=ORDER_INDEX).fillna(0)
+        orders['Costo totale (€)'] = orders['Costo risorse (€)'] + orders['Costo MP (€)']
+
+        areas = resources.groupby(by=AREA_INDEX, observed=True, as_index=False)[['Tempo risorsa', 'Costo risorse (€)']].sum()
+        orders, areas, resources = _sorted(orders, ORDER_INDEX), _sorted(areas, AREA_INDEX), _sorted(resources, RESOURCE_INDEX)
+        entry['rows'] = len(orders) + len(areas)
+
+    return orders, areas, resources
+
+
+def order_facts(dataset: dict = None) -> tuple:
+    # Ordini di produzione di tutti gli scenari, calcolati una volta per dati di input:
+    # - per (Scenario, articolo, ordine): quantità di output, ore, costo risorse, consumo e costo MP
+    # - per (Scenario, area, articolo, ordine): ore e costo delle risorse dell'area
+    # - per (Scenario, area, articolo, ordine, risorsa): ore, quantità di output e costo di ogni risorsa.
+    # Gli indici sono ordinati: il dettaglio di un articolo o di un'area è una lettura per intervallo
+    if dataset is None:
+        dataset = load_dataset()
+
+    return cached_stage('order_facts', dataset, _order_sources(dataset), _order_facts)
+
+
+def _slice(frame: pd.DataFrame, key: tuple) -> pd.DataFrame:
+    # Righe con i primi livelli dell'indice uguali a key: sull'indice ordinato è una ricerca per intervallo
+    try:
+        return frame.xs(key, drop_level=False)
+    except KeyError:
+        return frame.iloc[:0]
+
+
+def worst_orders(facts: tuple, base='budget', target='consuntivo', item: str = None, area: str = None,
+                 count: int = TOP_ORDERS) -> pd.DataFrame:
+    # Ordini target con lo scostamento più alto rispetto al costo standard dello scenario base:
+    # quantità di output per costo unitario base dello stesso articolo (nell'area, se indicata).
+    # Senza area il costo comprende le materie prime, con l'area solo le risorse di quell'area.
+    # Gli articoli senza ordini (o senza output) nello scenario base non hanno un costo standard:
+    # i loro ordini restano fuori dalla classifica invece di contare tutto il costo come scostamento
+    orders, areas = facts[:2]
+    key = () if item is None else (item,)
+
+    def select(scenario) -> pd.DataFrame:
+        scenario_orders = _slice(orders, (scenario_name(scenario),) + key).droplevel('Scenario')
+        if area is None:
+            return scenario_orders
+        # Ore e costi delle risorse dell'area, con la quantità di output dell'ordine: una fase
+        # intermedia dell'ordine può non avere output
+        return _slice(areas, (scenario_name(scenario), area) + key).droplevel(
+            ['Scenario', 'Area di produzione']).join(scenario_orders['Quantità di output'])
+
+    cost = 'Costo totale (€)' if area is None else 'Costo risorse (€)'
+    standard = select(base).groupby(level='Nr articolo', observed=True)[[cost, 'Quantità di output']].sum()
+    unit_cost = (standard[cost] / standard['Quantità di output']).rename('Costo unitario base (€/u)')
+
+    worst = select(target)[['Quantità di output', 'Tempo risorsa', cost]].join(unit_cost, on='Nr articolo')
+    worst = worst.loc[np.isfinite(worst['Costo unitario base (€/u)'])]
+    worst['Costo standard (€)'] = worst['Quantità di output'] * worst['Costo unitario base (€/u)']
+    worst['Scostamento (€)'] = worst[cost] - worst['Costo standard (€)']
+
+    return worst.nlargest(count, 'Scostamento (€)').reset_index()[
+        ['Nr articolo', ORDER, 'Quantità di output', 'Tempo risorsa', cost, 'Costo unitario base (€/u)',
+         'Costo standard (€)', 'Scostamento (€)']]
@@ -0,0 +1,35 @@
+import threading
+from collections import OrderedDict
+
+from dataset import source_fingerprint
+
+CACHE_SIZE = 64
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def cached_stage(name: str, dataset: dict, sources: tuple, function, *args):
+    # Il risultato di uno step viene memorizzato sotto l'impronta delle sole tabelle da cui dipende:
+    # se cambia un file, vengono ricalcolati solo gli step che lo usano.
+    # I risultati sono condivisi tra le chiamate e non vanno modificati.
+    key = (name, args) + tuple(source_fingerprint(dataset[source]) for source in sources)
+
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    result = function(dataset, *args)
+
+    with _lock:
+        _cache[key] = result
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+    return result
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
@@ -1,118 +1,172 @@
 import pandas as pd
-
-budget_costs = pd.read_excel(
-    "files/Costo orario risorse - budget.xlsx", decimal=',')
-final_costs = pd.read_excel(
-    "files/Costo orario risorse - consuntivo.xlsx", decimal=',')
-resource_usage = pd.read_excel(
-    "files/Impiego orario risorse.xlsx", decimal=',')
-
-# Budget
-budget_resource_usage = resource_usage.loc[(
-    resource_usage['budget/consuntivo'].str.lower() == "budget")]
-
-budget_resource_usage = budget_resource_usage.merge(
-    budget_costs,
-    how='left',
-    left_on=[
-        'Nr. Area di produzione',
-        'Risorsa'
-    ],
-    right_on=[
-        'Area di produzione',
-        'Risorsa'
-    ])
-
-budget_resource_usage['Costo (€)'] = budget_resource_usage['Costo orario (€/h)'] * \
-    budget_resource_usage['Tempo risorsa']
-
-budget_production_areas = budget_resource_usage.groupby(
-    by=['Area di produzione'], as_index=False).sum(numeric_only=True).sort_values(by=['Costo (€)'], ascending=False)
-
-# Final
-final_resource_usage = resource_usage.loc[(
-    resource_usage['budget/consuntivo'].str.lower() == "consuntivo")]
-
-final_resource_usage = final_resource_usage.merge(
-    final_costs,
-    how='left',
-    left_on=[
-        'Nr. Area di produzione',
-        'Risorsa'
-    ],
-    right_on=[
-        'Area di produzione',
-        'Risorsa'
-    ])
-
-final_resource_usage['Costo (€)'] = final_resource_usage['Costo orario (€/h)'] * \
-    final_resource_usage['Tempo risorsa']
-
-final_production_areas = final_resource_usage.groupby(
-    by=['Area di produzione'], as_index=False).sum(numeric_only=True).sort_values(by=['Costo (€)'], ascending=False)
-
-# Variances
-production_areas = budget_production_areas.merge(
-    final_production_areas, how='outer', on='Area di produzione', suffixes=[' budget', ' consuntivo']).fillna(0)
-
-production_areas['Δ'] = production_areas['Costo orario (€/h) consuntivo'] - \
-    production_areas['Costo orario (€/h) budget']
-
-# Export
-production_areas.to_excel('export/production_areas.xlsx')
-
-# actual_hours_production
-
-print(pd.DataFrame({
-    'Costo budget':
-        budget_production_areas['Costo (€)'].values,
-    'Costo consuntivo':
-        final_production_areas['Costo (€)'].values,
-}, index=[budget_production_areas['Area di produzione']]))
-
-# Analisi scostamento delle risorse
-
-# risorse usate a budget, raggruppate per area di produzione e risorse
-uso_risorse_budget = budget_resource_usage.groupby(
-    by=['Risorsa', 'Area di produzione'], as_index=False).sum(numeric_only=True).sort_values(by=['Area di produzione'], ascending=False)
-
-# risorse usate a consuntivo, raggruppate per area di produzione e risorse
-uso_risorse_consuntivo = final_resource_usage.groupby(
-    by=['Risorsa', 'Area di produzione'], as_index=False).sum(numeric_only=True).sort_values(by=['Area di produzione'], ascending=False)
-
-risorse_budget_consuntivo = uso_risorse_budget.merge(
-    uso_risorse_consuntivo, how='outer', on=['Area di produzione', 'Risorsa'], suffixes=[' budget', ' consuntivo']).sort_values(by=['Area di produzione'], ascending=False).fillna(0)
-
-# questo perché facendo il group-by, venivano sommati i costi orari per risorse per aree di produzione
-# anziché tenerli fissi come da tabella iniziale. Abbiamo quindi fatto un ulteriore merge per unire i costi a budget
-# delle risorse divise per area di produzione e le risorse usate a budget e a consuntivo
-risorse_budget_consuntivo_ore = risorse_budget_consuntivo.merge(
-    budget_costs, how='inner', on=['Area di produzione', 'Risorsa'], suffixes=[' budget', ' consuntivo'])
-
-# Tengo sia il costo orario che il tempo di utilizzo a budget
-costo_tot_budget = risorse_budget_consuntivo_ore['Costo (€) budget'].values
-
-# Tengo il costo orario a budget e il tempo a consuntivo
-costo_ore_effettive = risorse_budget_consuntivo_ore['Tempo risorsa consuntivo'].values * risorse_budget_consuntivo_ore['Costo orario (€/h)'].values
-
-# Tengo il costo orario e il tempo di utilizzo a consuntivo
-costo_tot_consuntivo = risorse_budget_consuntivo_ore['Costo (€) consuntivo'].values
-
-scostamento_risorse = pd.DataFrame({
-    'Area di produzione':
-        risorse_budget_consuntivo_ore['Area di produzione'].values,
-    'Risorsa':
-        risorse_budget_consuntivo_ore['Risorsa'].values,
-    'Costo budget':
-        costo_tot_budget,
-    'Δ tempo':
-        costo_ore_effettive - costo_tot_budget,
-    'Costo ore effettive':
-        costo_ore_effettive,
-    'Δ costo orario':
-        costo_tot_consuntivo - costo_ore_effettive,
-    'Costo consuntivo':
-        costo_tot_consuntivo,
-})
-
-scostamento_risorse.to_excel('export/scostamento_risorse.xlsx')
\ No newline at end of file
+from dataset import load_dataset, scenario_name, cost_source, cost_sources, resources_cost
+from export import export_results
+from pipeline import cached_stage
+from profiling import stage
+
+# Livelli dell'analisi delle risorse -> chiavi del group-by
+LEVELS = {
+    'area': ['Area di produzione'],
+    'resource': ['Area di produzione', 'Risorsa'],
+    'order': ['Nr. Ordine di produzione', 'Area di produzione', 'Risorsa'],
+}
+
+VALUE_COLUMNS = ['Righe budget', 'Tempo risorsa budget', 'Tempo valorizzato budget', 'Quantità di output budget',
+                 'Costo budget', 'Righe consuntivo', 'Tempo risorsa consuntivo', 'Tempo valorizzato consuntivo',
+                 'Quantità di output consuntivo', 'Costo consuntivo', 'Costo ore effettive']
+# Colonne di appoggio, non restituite da resource_variance
+HELPER_COLUMNS = ['Righe budget', 'Tempo valorizzato budget', 'Righe consuntivo', 'Tempo valorizzato consuntivo']
+
+
+def area_names(dataset: dict = None) -> pd.Series:
+    # Nome di ogni area di produzione: la descrizione più frequente delle sue righe di impiego
+    # (le descrizioni sono per lavorazione, es. "Tornitura (anche delle bussole saldate)")
+    if dataset is None:
+        dataset = load_dataset()
+    descriptions = dataset['resource_usage'].groupby(
+        by=['Nr. Area di produzione', 'Descrizione'], observed=True).size().sort_values(ascending=False, kind='stable')
+
+    return descriptions.reset_index().drop_duplicates('Nr. Area di produzione').set_index(
+        'Nr. Area di produzione')['Descrizione'].astype(str)
+
+
+def resource_sources(dataset: dict) -> tuple:
+    # Tabelle da cui dipendono le analisi delle risorse (un file di costi orari per scenario)
+    return ('resource_usage',) + tuple(cost_sources(dataset).values())
+
+
+def _resource_facts(dataset: dict, base: str, target: str, level: str) -> pd.DataFrame:
+    # Ore, quantità e costi di base e target alla grana del livello in un solo passaggio sulle righe di impiego
+    # (per ordine solo se richiesto: area e risorsa partono dalla grana area/risorsa, molto più piccola).
+    # Il costo orario è costante per scenario, area e risorsa: si somma prima e si moltiplica dopo, così i merge
+    # con i costi orari lavorano sulle righe aggregate
+    base, target = scenario_name(base), scenario_name(target)
+    resource_usage = dataset['resource_usage']
+    keys = [{'Area di produzione': 'Nr. Area di produzione'}.get(key, key) for key in LEVELS[level]]
+
+    with stage('resource_facts ' + level, 'aggregate') as entry:
+        usage = resource_usage.loc[resource_usage['Scenario'].isin([base, target])].groupby(
+            by=['Scenario'] + keys, observed=True, dropna=False)[['Tempo risorsa', 'Quantità di output']].sum()
+        usage = usage.reset_index().rename(columns={'Nr. Area di produzione': 'Area di produzione'})
+        entry['rows'] = len(usage)
+
+    with stage('resource_facts ' + level, 'merge') as entry:
+        # Costo orario dello scenario della riga e costo orario dello scenario base (per le ore effettive)
+        usage = usage.merge(
+            resources_cost(dataset)[['Scenario', 'Area di produzione', 'Risorsa', 'Costo orario (€/h)']].drop_duplicates(
+                ['Scenario', 'Area di produzione', 'Risorsa']),
+            how='left', on=['Scenario', 'Area di produzione', 'Risorsa']).merge(
+            dataset[cost_source(base)][['Area di produzione', 'Risorsa', 'Costo orario (€/h)']].drop_duplicates(
+                ['Area di produzione', 'Risorsa']).rename(columns={'Costo orario (€/h)': 'Costo orario base (€/h)'}),
+            how='left', on=['Area di produzione', 'Risorsa'])
+
+        # Ore e quantità contano tutte le righe dello scenario, il costo solo quelle con un costo orario nel
+        # proprio scenario: una risorsa senza costo orario non diventa un risparmio di tempo.
+        # Il costo orario medio si calcola sulle sole ore valorizzate
+        valid = usage['Costo orario (€/h)'].notna()
+        cost = usage['Tempo risorsa'] * usage['Costo orario (€/h)']
+        facts = usage[LEVELS[level] + ['Costo orario base (€/h)']].copy()
+        for label, scenario in (('budget', base), ('consuntivo', target)):
+            rows = usage['Scenario'] == scenario
+            facts['Righe ' + label] = rows.astype(int)
+            facts['Tempo risorsa ' + label] = usage['Tempo risorsa'].where(rows, 0)
+            facts['Tempo valorizzato ' + label] = usage['Tempo risorsa'].where(rows & valid, 0)
+            facts['Quantità di output ' + label] = usage['Quantità di output'].where(rows, 0)
+            facts['Costo ' + label] = cost.where(rows & valid, 0)
+        facts['Costo ore effettive'] = (facts['Tempo risorsa consuntivo'] * facts['Costo orario base (€/h)']).fillna(0)
+        entry['rows'] = len(facts)
+
+    return facts
+
+
+def _variances(facts: pd.DataFrame, keys: list) -> pd.DataFrame:
+    # Somme al livello richiesto, costi orari pesati sulle ore e scostamenti tempo/costo orario
+    aggregations = {column: (column, 'sum') for column in VALUE_COLUMNS}
+    if 'Risorsa' in keys:
+        # Il costo orario base è unico per area e risorsa
+        aggregations['Costo orario base (€/h)'] = ('Costo orario base (€/h)', 'first')
+    variances = facts.groupby(by=keys, as_index=False, observed=True, dropna=False).agg(**aggregations)
+    variances = variances.loc[(variances['Righe budget'] + variances['Righe consuntivo']) > 0]
+
+    for label in ('budget', 'consuntivo'):
+        variances['Costo orario ' + label + ' (€/h)'] = (
+            variances['Costo ' + label] / variances['Tempo valorizzato ' + label]).fillna(0)
+    variances['Δ tempo'] = variances['Costo ore effettive'] - variances['Costo budget']
+    variances['Δ costo orario'] = variances['Costo consuntivo'] - variances['Costo ore effettive']
+
+    return variances.drop(columns=HELPER_COLUMNS).reset_index(drop=True)
+
+
+def resource_variance(dataset: dict = None, base: str = 'budget', target: str = 'consuntivo',
+                      level: str = 'resource') -> pd.DataFrame:
+    # Costo budget, costo delle ore effettive (ore target al costo orario base), costo consuntivo e scostamenti
+    # per area, per risorsa (area e risorsa) o per ordine di produzione (ordine, area e risorsa).
+    # Le aree sommano gli aggregati per area e risorsa, calcolati una volta per coppia di scenari
+    if dataset is None:
+        dataset = load_dataset()
+    grain = 'order' if level == 'order' else 'resource'
+    facts = cached_stage('resource_facts', dataset, resource_sources(dataset), _resource_facts, base, target, grain)
+
+    with stage('resource_variance ' + level, 'aggregate') as entry:
+        variances = _variances(facts, LEVELS[level])
+        entry['rows'] = len(variances)
+
+    return variances
+
+
+def production_area_analysis(dataset: dict = None, base: str = 'budget', target: str = 'consuntivo') -> tuple:
+    if dataset is None:
+        dataset = load_dataset()
+
+    # Aree di produzione
+    areas = resource_variance(dataset, base, target, 'area')
+    production_areas = pd.DataFrame({
+        'Area di produzione': areas['Area di produzione'].values,
+        'Tempo risorsa budget': areas['Tempo risorsa budget'].values,
+        'Quantità di output budget': areas['Quantità di output budget'].values,
+        'Costo orario (€/h) budget': areas['Costo orario budget (€/h)'].values,
+        'Costo (€) budget': areas['Costo budget'].values,
+        'Tempo risorsa consuntivo': areas['Tempo risorsa consuntivo'].values,
+        'Quantità di output consuntivo': areas['Quantità di output consuntivo'].values,
+        'Costo orario (€/h) consuntivo': areas['Costo orario consuntivo (€/h)'].values,
+        'Costo (€) consuntivo': areas['Costo consuntivo'].values,
+    }).sort_values(by=['Costo (€) budget', 'Costo (€) consuntivo'], ascending=False, kind='stable', ignore_index=True)
+
+    production_areas['Δ'] = production_areas['Costo orario (€/h) consuntivo'] - \
+        production_areas['Costo orario (€/h) budget']
+
+    # Analisi scostamento delle risorse: solo le coppie area/risorsa con un costo orario nello scenario base
+    resources = resource_variance(dataset, base, target, 'resource')
+    resources = resources.loc[resources['Costo orario base (€/h)'].notna()].sort_values(
+        by=['Area di produzione', 'Risorsa'], ascending=[False, True], kind='stable')
+
+    scostamento_risorse = pd.DataFrame({
+        'Area di produzione':
+            resources['Area di produzione'].values,
+        'Risorsa':
+            resources['Risorsa'].values,
+        'Costo budget':
+            resources['Costo budget'].values,
+        'Δ tempo':
+            resources['Δ tempo'].values,
+        'Costo ore effettive':
+            resources['Costo ore effettive'].values,
+        'Δ costo orario':
+            resources['Δ costo orario'].values,
+        'Costo consuntivo':
+            resources['Costo consuntivo'].values,
+    })
+
+    return production_areas, scostamento_risorse
+
+
+if __name__ == "__main__":
+    production_areas, scostamento_risorse = production_area_analysis()
+
+    print(production_areas.set_index('Area di produzione')[
+        ['Costo (€) budget', 'Costo (€) consuntivo']])
+
+    export_results({
+        'production_areas': production_areas,
+        'scostamento_risorse': scostamento_risorse,
+    })
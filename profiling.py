@@ -0,0 +1,147 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+# Record del profiling in corso (None = profiling disattivo, gli step non misurano nulla).
+# È legato al contesto: sessioni diverse della dashboard non si mescolano e run_stages
+# lo passa ai thread che eseguono gli step
+_trace = contextvars.ContextVar('trace', default=None)
+# Step aperti (per propagare il picco di memoria agli step esterni) e inizio dell'ultimo lap()
+_open = contextvars.ContextVar('open', default=())
+_last_lap = contextvars.ContextVar('last_lap', default=None)
+
+# tracemalloc è globale: resta attivo finché c'è almeno un profiling in corso
+_tracing = 0
+_lock = threading.Lock()
+
+
+def start_trace() -> list:
+    global _tracing
+    with _lock:
+        if _tracing == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracing += 1
+
+    records = []
+    _trace.set(records)
+    _last_lap.set((time.perf_counter(), time.thread_time(), tracemalloc.get_traced_memory()[0]))
+    return records
+
+
+def stop_trace(records: list) -> list:
+    global _tracing
+    if _trace.get() is records:
+        _trace.set(None)
+    with _lock:
+        _tracing -= 1
+        if _tracing == 0:
+            tracemalloc.stop()
+    return records
+
+
+@contextmanager
+def profile():
+    # Un profiling annidato (es. le analisi dentro la dashboard) ha un trace suo, poi torna quello esterno
+    previous = _trace.get()
+    records = start_trace()
+    try:
+        yield records
+    finally:
+        stop_trace(records)
+        _trace.set(previous)
+
+
+def rows(result) -> int:
+    # Righe prodotte da uno step (somma per tuple/dizionari di DataFrame)
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return len(result)
+    if isinstance(result, dict):
+        result = list(result.values())
+    if isinstance(result, (tuple, list)):
+        return sum(rows(part) for part in result)
+    return 0
+
+
+def _peak() -> int:
+    # Picco dall'ultimo azzeramento, riportato agli step ancora aperti prima di azzerarlo di nuovo.
+    # Con step in parallelo i picchi si sovrappongono: la memoria è una stima, i tempi no
+    peak = tracemalloc.get_traced_memory()[1]
+    for entry in _open.get():
+        entry['_peak'] = max(entry['_peak'], peak)
+    return peak
+
+
+def _record(records: list, name: str, kind: str, wall: float, cpu: float, peak_bytes: int, count: int = None):
+    records.append({
+        'stage': name,
+        'kind': kind,
+        'wall_s': round(wall, 6),
+        'cpu_s': round(cpu, 6),
+        'rows': count,
+        'peak_mb': round(max(peak_bytes, 0) / 2 ** 20, 3),
+    })
+
+
+@contextmanager
+def stage(name: str, kind: str):
+    # kind: load, merge, aggregate, analysis, export, render, benchmark.
+    # Nel dizionario restituito si possono indicare le righe prodotte (entry['rows'])
+    records = _trace.get()
+    if records is None:
+        yield {}
+        return
+
+    _peak()
+    tracemalloc.reset_peak()
+    start_memory = tracemalloc.get_traced_memory()[0]
+    entry = {'_peak': start_memory, 'rows': None}
+    token = _open.set(_open.get() + (entry,))
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield entry
+    finally:
+        wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+        _peak()
+        _open.reset(token)
+        _record(records, name, kind, wall, cpu, entry['_peak'] - start_memory, entry['rows'])
+
+
+def lap(name: str, kind: str = 'render', result=None):
+    # Misura il tratto di codice dall'ultimo lap() (o dall'inizio del profiling): comodo negli script
+    # lineari come la dashboard, dove racchiudere ogni sezione in un blocco with non è pratico
+    records = _trace.get()
+    if records is None:
+        return
+
+    wall, cpu, start_memory = _last_lap.get()
+    peak = _peak()
+    tracemalloc.reset_peak()
+    _record(records, name, kind, time.perf_counter() - wall, time.thread_time() - cpu, peak - start_memory,
+            None if result is None else rows(result))
+    _last_lap.set((time.perf_counter(), time.thread_time(), tracemalloc.get_traced_memory()[0]))
+
+
+def trace_table(records: list) -> pd.DataFrame:
+    # Le colonne aggiuntive dei record (es. entity e period del batch) seguono quelle standard
+    columns = ['stage', 'kind', 'wall_s', 'cpu_s', 'rows', 'peak_mb']
+    table = pd.DataFrame(records)
+    return table.reindex(columns=columns + [column for column in table.columns if column not in columns])
+
+
+def trace_json(records: list) -> str:
+    # Trace JSON: elenco degli step in ordine di completamento, più i totali per tipo
+    totals = trace_table(records).groupby('kind')[['wall_s', 'cpu_s']].sum().round(6)
+    return json.dumps({'stages': records, 'totals': totals.to_dict(orient='index')}, indent=2, default=str)
+
+
+def write_trace(records: list, file: str):
+    # La cartella del trace può non esistere ancora (es. --output di batch.py)
+    os.makedirs(os.path.dirname(file) or ".", exist_ok=True)
+    with open(file, "w") as f:
+        f.write(trace_json(records))
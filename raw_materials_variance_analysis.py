@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+from dataset import load_dataset, filter_scenario
+from export import export_results
+from materials import raw_material_facts
+
+KEYS = ['Codice MP', 'Nr articolo']
+
+
+def raw_materials_variance_analysis(dataset: dict = None, base: str = 'budget', target: str = 'consuntivo') -> pd.DataFrame:
+    if dataset is None:
+        dataset = load_dataset()
+    facts = raw_material_facts(dataset).dropna(subset=KEYS)
+
+    consumi = filter_scenario(facts, base)[KEYS + ['Quantità MP impiegata', 'Costo MP (€)']].merge(
+        filter_scenario(facts, target)[KEYS + ['Quantità MP impiegata', 'Costo MP (€)']],
+        how='outer', on=KEYS, suffixes=[' budget', ' consuntivo']).fillna(0)
+
+    quantita_budget = consumi['Quantità MP impiegata budget'].values
+    quantita_consuntivo = consumi['Quantità MP impiegata consuntivo'].values
+    costo_tot_budget = consumi['Costo MP (€) budget'].values
+    costo_tot_consuntivo = consumi['Costo MP (€) consuntivo'].values
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        prezzo_consuntivo = np.where(quantita_consuntivo != 0, costo_tot_consuntivo / quantita_consuntivo, 0)
+        # Una materia prima senza quantità a budget (non prevista) viene valorizzata al prezzo consuntivo:
+        # tutto lo scostamento è di quantità
+        prezzo_budget = np.where(quantita_budget != 0, costo_tot_budget / quantita_budget, prezzo_consuntivo)
+
+    # Tengo il prezzo unitario a budget e la quantità a consuntivo
+    costo_quantita_effettive = quantita_consuntivo * prezzo_budget
+
+    scostamento_materie_prime = pd.DataFrame({
+        'Codice MP':
+            consumi['Codice MP'].values,
+        'Nr articolo':
+            consumi['Nr articolo'].values,
+        'Quantità budget':
+            quantita_budget,
+        'Quantità consuntivo':
+            quantita_consuntivo,
+        'Prezzo unitario budget (€/u)':
+            prezzo_budget,
+        'Prezzo unitario consuntivo (€/u)':
+            prezzo_consuntivo,
+        'Costo budget':
+            costo_tot_budget,
+        'Δ quantità':
+            costo_quantita_effettive - costo_tot_budget,
+        'Costo quantità effettive':
+            costo_quantita_effettive,
+        'Δ prezzo unitario':
+            costo_tot_consuntivo - costo_quantita_effettive,
+        'Costo consuntivo':
+            costo_tot_consuntivo,
+    })
+
+    return scostamento_materie_prime.sort_values(by=KEYS, kind='stable', ignore_index=True)
+
+
+if __name__ == "__main__":
+    scostamento_materie_prime = raw_materials_variance_analysis()
+
+    print(scostamento_materie_prime[['Costo budget', 'Δ quantità', 'Δ prezzo unitario', 'Costo consuntivo']].sum())
+
+    export_results({'scostamento_materie_prime': scostamento_materie_prime})
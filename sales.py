@@ -0,0 +1,168 @@
+import numpy as np
+import pandas as pd
+
+from dataset import load_dataset, filter_scenario
+from pipeline import cached_stage
+from profiling import stage
+
+# Tabelle da cui dipendono le vendite in euro
+SALES_SOURCES = ('sales', 'customers', 'exchange_rates')
+
+AMOUNT = 'Importo vendita in valuta locale (TOTALE VENDITA)'
+
+# Grana della tabella dei fatti: valuta e tasso dipendono solo da scenario e cliente,
+# quindi si possono aggiungere dopo l'aggregazione
+FACT_KEYS = ['Scenario', 'Nr. origine', 'Nr articolo']
+
+# Tassi di cambio datati (giornalieri, mensili, ...): ogni tasso vale dalla sua data fino al successivo
+# e le fatture si convertono con il tasso in vigore alla data di registrazione
+RATE_DATE = 'Data'
+INVOICE_DATE = 'Data registrazione'
+
+
+def _positions(values: pd.Series, labels: pd.Index) -> np.ndarray:
+    # Posizione di ogni valore nell'indice (-1 se assente). Con una colonna categorica
+    # la ricerca avviene una volta per categoria, le righe usano solo i codici
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = values.cat.codes.to_numpy()
+        return np.where(codes >= 0, labels.get_indexer(values.cat.categories)[codes], -1)
+    return labels.get_indexer(values)
+
+
+def _days(values: pd.Series) -> np.ndarray:
+    # Date come numero di giorni (le date mancanti restano NaT, come nel file)
+    return pd.to_datetime(values.to_numpy(), dayfirst=True).to_numpy().astype('datetime64[D]')
+
+
+def dated_rates(sales: pd.DataFrame, exchange_rates: pd.DataFrame) -> bool:
+    # Con un tasso medio per scenario e valuta (Tassi di cambio.xlsx) la conversione avviene dopo
+    # l'aggregazione, con tassi datati serve la data di ogni fattura
+    if RATE_DATE not in exchange_rates.columns:
+        return False
+    if INVOICE_DATE not in sales.columns:
+        raise ValueError(f"Tassi di cambio con la colonna '{RATE_DATE}': "
+                         f"le vendite devono avere la colonna '{INVOICE_DATE}'")
+    return True
+
+
+def add_exchange_rates(sales: pd.DataFrame, customers: pd.DataFrame, exchange_rates: pd.DataFrame) -> pd.DataFrame:
+    # Valuta e tasso di cambio di ogni riga (Scenario, Nr. origine) con due ricerche su indici hash,
+    # cliente -> valuta e (scenario, valuta) -> tasso, al posto dei due merge in sequenza.
+    # Come nel merge left, clienti e tassi mancanti restano NaN; a chiavi ripetute vale la prima riga
+    customers = customers.drop_duplicates('Nr.')
+    exchange_rates = exchange_rates.drop_duplicates(['Scenario', 'Codice valuta'])
+
+    scenario_labels = pd.Index(exchange_rates['Scenario'].astype(object).unique())
+    currency_labels = pd.Index(exchange_rates['Codice valuta'].unique())
+    # Riga e colonna in più di NaN: la posizione -1 (chiave assente) legge lì
+    rates = np.full((len(scenario_labels) + 1, len(currency_labels) + 1), np.nan)
+    rates[scenario_labels.get_indexer(exchange_rates['Scenario'].astype(object)),
+          currency_labels.get_indexer(exchange_rates['Codice valuta'])] = exchange_rates['Tasso di cambio medio']
+
+    customer = _positions(sales['Nr. origine'], pd.Index(customers['Nr.'].astype(object)))
+    currency = np.append(currency_labels.get_indexer(customers['Valuta']), -1)[customer]
+    scenario = _positions(sales['Scenario'], scenario_labels)
+
+    currencies = customers['Valuta'].to_numpy()
+    if (customer < 0).any():
+        currencies = np.append(currencies.astype(float), np.nan)
+
+    return sales.assign(**{
+        'Valuta': currencies[customer],
+        'Tasso di cambio medio': rates[scenario, currency],
+    })
+
+
+def asof_rates(sales: pd.DataFrame, customers: pd.DataFrame, exchange_rates: pd.DataFrame) -> np.ndarray:
+    # Tasso in vigore alla data di ogni fattura: join as-of all'indietro per (scenario, valuta).
+    # I tassi vengono ordinati per (scenario, valuta, data) in un'unica chiave intera e ogni fattura
+    # è una ricerca binaria (searchsorted), senza ordinare né raggruppare le vendite.
+    # Le fatture precedenti al primo tasso (o senza data) usano il primo tasso della valuta
+    exchange_rates = exchange_rates.drop_duplicates(['Scenario', 'Codice valuta', RATE_DATE], keep='last')
+    exchange_rates = exchange_rates.loc[exchange_rates[RATE_DATE].notna()]
+    customers = customers.drop_duplicates('Nr.')
+
+    scenario_labels = pd.Index(exchange_rates['Scenario'].astype(object).unique())
+    currency_labels = pd.Index(exchange_rates['Codice valuta'].unique())
+    width = len(currency_labels)
+
+    rate_days = _days(exchange_rates[RATE_DATE])
+    first_day = rate_days.min()
+    span = (rate_days.max() - first_day).astype(np.int64) + 1
+    rate_groups = scenario_labels.get_indexer(exchange_rates['Scenario'].astype(object)) * width + \
+        currency_labels.get_indexer(exchange_rates['Codice valuta'])
+    rate_keys = rate_groups * span + (rate_days - first_day).astype(np.int64)
+    order = np.argsort(rate_keys, kind='stable')
+    rate_keys = rate_keys[order]
+    rate_groups = np.append(rate_groups[order], -1)
+    rates = np.append(exchange_rates['Tasso di cambio medio'].to_numpy(dtype=float)[order], np.nan)
+
+    customer = _positions(sales['Nr. origine'], pd.Index(customers['Nr.'].astype(object)))
+    currency = np.append(currency_labels.get_indexer(customers['Valuta']), -1)[customer]
+    scenario = _positions(sales['Scenario'], scenario_labels)
+    groups = np.where((scenario >= 0) & (currency >= 0), scenario * width + currency, -1)
+
+    invoice_days = _days(sales[INVOICE_DATE])
+    offset = np.clip((invoice_days - first_day).astype(np.int64), 0, span - 1)
+    offset[np.isnat(invoice_days)] = 0
+    keys = groups * span + offset
+
+    position = np.searchsorted(rate_keys, keys, side='right') - 1
+    position = np.where(rate_groups[position] == groups, position,
+                        np.searchsorted(rate_keys, groups * span, side='left'))
+    position = np.where((groups >= 0) & (rate_groups[position] == groups), position, -1)
+    return rates[position]
+
+
+def convert_facts(facts: pd.DataFrame, customers: pd.DataFrame, exchange_rates: pd.DataFrame) -> pd.DataFrame:
+    # Valuta, tasso e importo in euro delle vendite aggregate. Con tassi datati l'importo in euro è già
+    # la somma delle fatture convertite: il tasso della riga è quello medio effettivo (valuta locale / euro)
+    facts = add_exchange_rates(facts, customers, exchange_rates)
+    if 'Prezzo (€)' in facts.columns:
+        facts['Tasso di cambio medio'] = facts[AMOUNT] / facts['Prezzo (€)']
+    else:
+        facts['Prezzo (€)'] = facts[AMOUNT] / facts['Tasso di cambio medio']
+    return facts
+
+
+def convert_invoices(sales: pd.DataFrame, customers: pd.DataFrame, exchange_rates: pd.DataFrame) -> pd.DataFrame:
+    # Fatture con l'importo in euro al tasso della loro data, pronte per essere aggregate per FACT_KEYS
+    return sales[FACT_KEYS + ['Quantità', AMOUNT]].assign(**{
+        'Prezzo (€)': sales[AMOUNT].to_numpy() / asof_rates(sales, customers, exchange_rates)})
+
+
+def _sales_facts(dataset: dict) -> pd.DataFrame:
+    # Prima si aggrega (il tasso è costante per scenario e cliente), poi si arricchisce la tabella
+    # aggregata: il join avviene una volta sola per tutti gli scenari e su poche righe.
+    # Con tassi datati la conversione avviene sulle singole fatture, prima dell'aggregazione
+    sales = dataset['sales']
+    dated = dated_rates(sales, dataset['exchange_rates'])
+    if dated:
+        with stage('sales_facts', 'merge') as entry:
+            sales = convert_invoices(sales, dataset['customers'], dataset['exchange_rates'])
+            entry['rows'] = len(sales)
+
+    with stage('sales_facts', 'aggregate') as entry:
+        facts = sales.groupby(by=FACT_KEYS, observed=True, dropna=False)[
+            ['Quantità', AMOUNT] + (['Prezzo (€)'] if dated else [])].sum(min_count=int(dated)).reset_index()
+        entry['rows'] = len(facts)
+
+    with stage('sales_facts', 'merge') as entry:
+        facts = convert_facts(facts, dataset['customers'], dataset['exchange_rates'])
+        entry['rows'] = len(facts)
+
+    return facts
+
+
+def sales_facts(dataset: dict = None) -> pd.DataFrame:
+    # Vendite di tutti gli scenari per (Scenario, cliente, articolo) con valuta, tasso (medio effettivo,
+    # con tassi datati) e importo in euro: la usano l'economia per articolo, lo scostamento per cliente e quello prezzo/cambio
+    if dataset is None:
+        dataset = load_dataset()
+
+    return cached_stage('sales_facts', dataset, SALES_SOURCES, _sales_facts)
+
+
+def scenario_facts(facts: pd.DataFrame, scenario) -> pd.DataFrame:
+    # Righe di uno scenario, senza le chiavi mancanti (come nei group-by delle analisi)
+    return filter_scenario(facts, scenario).dropna(subset=FACT_KEYS)
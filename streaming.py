@@ -0,0 +1,163 @@
+import os
+
+import openpyxl
+import pandas as pd
+
+from dataset import FILES_DIR, SOURCES, SCENARIO_COLUMNS, CSV_OPTIONS, cost_files, find_source, read_workbook
+from sales import AMOUNT, FACT_KEYS, INVOICE_DATE, RATE_DATE, convert_facts, convert_invoices
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+CHUNKSIZE = 100_000
+
+# Colonne effettivamente usate dalle aggregazioni: il resto viene scartato subito
+SALES_COLUMNS = ['budget/cons', 'Nr articolo', 'Nr. origine', 'Quantità',
+                 'Importo vendita in valuta locale (TOTALE VENDITA)']
+RESOURCE_USAGE_COLUMNS = ['budget/consuntivo', 'nr articolo', 'Nr. Area di produzione', 'Risorsa',
+                          'Tempo risorsa', 'Quantità di output']
+RAW_MATERIALS_COLUMNS = ['Budget/cons', 'Nr articolo', 'Importo costo (TOTALE)']
+
+
+def _rows_to_frame(rows: list, header: list, columns: list) -> pd.DataFrame:
+    frame = pd.DataFrame(rows, columns=header)
+    return frame if columns is None else frame[columns]
+
+
+def iter_chunks(path: str, chunksize: int = CHUNKSIZE, columns: list = None):
+    # Restituisce il file a blocchi di al massimo chunksize righe, senza mai caricarlo tutto
+    path = find_source(path)
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == '.csv':
+        yield from pd.read_csv(path, chunksize=chunksize, usecols=columns, **CSV_OPTIONS)
+    elif extension == '.parquet':
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            header = list(next(rows))
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) == chunksize:
+                    yield _rows_to_frame(chunk, header, columns)
+                    chunk = []
+            if chunk:
+                yield _rows_to_frame(chunk, header, columns)
+        finally:
+            workbook.close()
+
+
+def _filter_scenarios(chunk: pd.DataFrame, column: str, scenarios: tuple) -> pd.DataFrame:
+    # Restano solo le righe degli scenari confrontati: le altre (e quelle senza scenario)
+    # vengono scartate subito, prima di qualsiasi merge o somma
+    scenario = chunk[column].str.lower()
+    keep = scenario.isin(scenarios)
+    return chunk.loc[keep].assign(Scenario=scenario[keep])
+
+
+def _fold(total, part):
+    # Accumula le somme parziali: la dimensione dipende dal numero di chiavi, non di righe
+    return part if total is None else total.add(part, fill_value=0)
+
+
+def _scenario_totals(totals, scenario: str):
+    # Somme di uno scenario: vuote se lo scenario non ha righe (es. un forecast con le sole vendite),
+    # come nel caricamento completo dove il merge lascia i costi mancanti a NaN
+    if totals is None:
+        return pd.Series(dtype=float)
+    if scenario not in totals.index.unique(level='Scenario'):
+        return totals.iloc[:0].droplevel('Scenario')
+    return totals.loc[scenario]
+
+
+def _scenario_items(sales: pd.DataFrame, resources: pd.Series, raw_materials: pd.Series) -> pd.DataFrame:
+    # Stesso risultato di getItem(), a partire dalle somme per articolo
+    item = sales.copy()
+    item['Prezzo unitario (€/u)'] = item['Prezzo (€)'] / item['Quantità']
+    item['Mix (%)'] = item['Quantità'] / item['Quantità'].sum()
+
+    item_cost = pd.concat([resources.rename('Costo risorse (€)'),
+                           raw_materials.rename('Costo MP (€)')], axis=1, join='inner')
+    item_cost['Costo totale (€)'] = item_cost['Costo MP (€)'] + item_cost['Costo risorse (€)']
+    quantity = item['Quantità'].reindex(item_cost.index)
+
+    item['Costo unitario (€/u)'] = item_cost['Costo totale (€)'] / quantity
+    item['Costo unitario MP (€/u)'] = item_cost['Costo MP (€)'] / quantity
+    item['Costo unitario risorse (€/u)'] = item_cost['Costo risorse (€)'] / quantity
+
+    return item.rename_axis('Nr articolo').reset_index()[
+        ['Nr articolo', 'Quantità', 'Prezzo unitario (€/u)', 'Costo unitario (€/u)',
+         'Costo unitario MP (€/u)', 'Costo unitario risorse (€/u)', 'Mix (%)']]
+
+
+def stream_aggregates(path: str = FILES_DIR, chunksize: int = CHUNKSIZE,
+                      base: str = 'budget', target: str = 'consuntivo') -> dict:
+    # Le tabelle di riferimento (clienti, cambi, costi orari) sono piccole e vengono lette intere,
+    # vendite, impiego risorse e consumi invece vengono letti a blocchi in un solo passaggio
+    scenarios = (base, target)
+    customers = read_workbook(path + SOURCES['customers'])[['Nr.', 'Valuta']]
+    exchange_rates = _filter_scenarios(
+        read_workbook(path + SOURCES['exchange_rates']), SCENARIO_COLUMNS['exchange_rates'], scenarios)
+    dated = RATE_DATE in exchange_rates.columns
+    exchange_rates = exchange_rates[['Scenario', 'Codice valuta', 'Tasso di cambio medio'] + ([RATE_DATE] if dated else [])]
+    resources_cost = pd.concat([
+        read_workbook(file).assign(Scenario=scenario) for scenario, file in cost_files(path).items()])
+
+    # Vendite: i blocchi vengono sommati per (Scenario, cliente, articolo), valuta e tasso di cambio
+    # si aggiungono una volta sola alla fine, come in sales.sales_facts (con tassi datati ogni
+    # blocco viene convertito in euro prima di essere sommato)
+    sales = None
+    for chunk in iter_chunks(path + SOURCES['sales'], chunksize, SALES_COLUMNS + ([INVOICE_DATE] if dated else [])):
+        chunk = _filter_scenarios(chunk, SCENARIO_COLUMNS['sales'], scenarios)
+        if dated:
+            chunk = convert_invoices(chunk, customers, exchange_rates)
+        sales = _fold(sales, chunk.groupby(FACT_KEYS, observed=True, dropna=False)[
+            ['Quantità', AMOUNT] + (['Prezzo (€)'] if dated else [])].sum(min_count=int(dated)))
+
+    sales = convert_facts(sales.reset_index(), customers, exchange_rates)
+    sales_per_item = sales.groupby(['Scenario', 'Nr articolo'], observed=True)[['Quantità', 'Prezzo (€)']].sum()
+    sales_per_client = sales.groupby(['Scenario', 'Nr. origine'], observed=True)[['Quantità', 'Prezzo (€)']].sum()
+
+    # Impiego risorse
+    resources_per_item = None
+    resources_per_area = None
+    for chunk in iter_chunks(path + SOURCES['resource_usage'], chunksize, RESOURCE_USAGE_COLUMNS):
+        chunk = _filter_scenarios(chunk, SCENARIO_COLUMNS['resource_usage'], scenarios).merge(
+            resources_cost, how="left", left_on=['Scenario', 'Risorsa', 'Nr. Area di produzione'],
+            right_on=['Scenario', 'Risorsa', 'Area di produzione'])
+        chunk['Costo (€)'] = chunk['Tempo risorsa'] * chunk['Costo orario (€/h)']
+
+        resources_per_item = _fold(resources_per_item, chunk.groupby(
+            ['Scenario', 'nr articolo'], observed=True)['Costo (€)'].sum())
+        resources_per_area = _fold(resources_per_area, chunk.groupby(
+            ['Scenario', 'Nr. Area di produzione'], observed=True)[['Tempo risorsa', 'Quantità di output', 'Costo (€)']].sum())
+
+    # Consumi
+    raw_materials_per_item = None
+    for chunk in iter_chunks(path + SOURCES['raw_materials_usage'], chunksize, RAW_MATERIALS_COLUMNS):
+        chunk = _filter_scenarios(chunk, SCENARIO_COLUMNS['raw_materials_usage'], scenarios)
+        raw_materials_per_item = _fold(raw_materials_per_item, chunk.groupby(
+            ['Scenario', 'Nr articolo'], observed=True)['Importo costo (TOTALE)'].sum())
+
+    # Articoli, clienti e aree della coppia base/target
+    return {
+        'items': {
+            scenario: _scenario_items(sales_per_item.loc[scenario], _scenario_totals(resources_per_item, scenario),
+                                      _scenario_totals(raw_materials_per_item, scenario))
+            for scenario in sales_per_item.index.unique(level='Scenario')
+        },
+        'scostamento_volume_cliente': sales_per_client.loc[base].rename(columns={
+            'Quantità': 'Quantità budget', 'Prezzo (€)': 'Prezzo budget (€)'}).join(
+            sales_per_client.loc[target].rename(columns={
+                'Quantità': 'Quantità consuntivo', 'Prezzo (€)': 'Prezzo consuntivo (€)'}),
+            how='outer').rename_axis('Nr. origine').reset_index(),
+        'costo_aree': _scenario_totals(resources_per_area, base).join(
+            _scenario_totals(resources_per_area, target), how='outer', lsuffix=' budget', rsuffix=' consuntivo').rename_axis(
+            'Area di produzione').reset_index(),
+    }
@@ -0,0 +1,209 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from dataset import SOURCES, COSTS_PREFIX, CSV_OPTIONS, cost_source, cost_sources
+from sales import INVOICE_DATE, RATE_DATE
+
+# Dati sintetici con lo stesso schema dei file in files/, per misurare le analisi su volumi reali.
+# Le proporzioni tra le tabelle seguono il campione: per ogni riga di vendita circa 2 righe
+# di impiego risorse e 1.5 di consumi, 6 righe di impiego per ordine di produzione
+USAGE_RATIO = 2.1
+CONSUMPTION_RATIO = 1.5
+ROWS_PER_ORDER = 6
+
+# Con tassi datati: un tasso al mese per valuta e scenario, fatture distribuite sull'anno
+YEAR = 2023
+
+FORMATS = ('parquet', 'csv', 'xlsx')
+XLSX_MAX_ROWS = 1_048_575
+
+AREA_DESCRIPTIONS = ['Preparazione materiale', 'Saldatura', 'Piegatura', 'Tornitura', 'Fresatura',
+                     'Foratura/Maschiatura', 'Brocciatura / stozzatrice', 'Rettifica', 'Verniciatura',
+                     'Montaggio', 'Controllo qualità']
+
+
+def _codes(prefix: str, count: int, width: int) -> np.ndarray:
+    return np.array([prefix + str(number).zfill(width) for number in range(1, count + 1)], dtype=object)
+
+
+def _labels(categories: np.ndarray, codes: np.ndarray) -> pd.Categorical:
+    # Le colonne testuali sono categoriche: anche a 10^7 righe occupano pochi byte per valore
+    return pd.Categorical.from_codes(codes, categories=categories)
+
+
+def _popularity(rng: np.random.Generator, count: int) -> np.ndarray:
+    # Poche voci molto frequenti e una coda lunga, come gli articoli e i clienti reali
+    weights = 1.0 / np.arange(1, count + 1) ** 0.8
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def generate(rows: int = 10_000, items: int = 500, customers: int = 100, currencies: int = 3, areas: int = 10,
+             resources: int = 15, raw_materials: int = 700, scenarios: tuple = ('budget', 'consuntivo'),
+             seed: int = 0, dated_rates: bool = False) -> dict:
+    # Restituisce i DataFrame con i nomi logici di dataset.SOURCES, più "costs <scenario>" per gli
+    # scenari oltre budget e consuntivo (es. forecast)
+    rng = np.random.default_rng(seed)
+    scenario_labels = np.array([scenario.upper() for scenario in scenarios], dtype=object)
+    item_codes = _codes('ART', items, 7)
+    item_weights = _popularity(rng, items)
+
+    # Clienti: la valuta 1 è l'euro, la più diffusa
+    customer_codes = _codes('C', customers, 5)
+    currency_weights = np.full(currencies, 1.0)
+    currency_weights[0] = 3.0 * currencies
+    customers_frame = pd.DataFrame({
+        'Nr.': customer_codes,
+        'Cod. condizioni pagam.': rng.integers(101, 111, customers),
+        'Fatt. cumulative': rng.random(customers) < 0.2,
+        'Valuta': rng.choice(np.arange(1, currencies + 1), customers, p=currency_weights / currency_weights.sum()),
+    })
+
+    # Tassi di cambio: un tasso medio per valuta e scenario (1 per l'euro), oppure
+    # con dated_rates uno al primo di ogni mese, che oscilla attorno al tasso medio
+    base_rates = np.concatenate([[1.0], np.round(np.exp(rng.normal(0.5, 1.5, currencies - 1)), 4)])
+    periods = 12 if dated_rates else 1
+    exchange_rates = pd.DataFrame({
+        'Codice valuta': np.tile(np.arange(1, currencies + 1), len(scenarios) * periods),
+        'Anno': np.repeat(scenario_labels, currencies * periods),
+        'Tasso di cambio medio': np.concatenate([
+            np.round(base_rates * np.concatenate([[1.0], rng.normal(1.0, 0.05, currencies - 1)]), 4)
+            for _ in range(len(scenarios) * periods)]),
+    })
+    if dated_rates:
+        months = pd.date_range(str(YEAR), periods=periods, freq='MS')
+        exchange_rates.insert(2, RATE_DATE, np.tile(np.repeat(months, currencies), len(scenarios)))
+
+    # Vendite
+    sales_scenario = rng.integers(0, len(scenarios), rows)
+    sales_item = rng.choice(items, rows, p=item_weights)
+    sales_customer = rng.choice(customers, rows, p=_popularity(rng, customers))
+    quantity = rng.integers(1, 50, rows)
+    list_price = np.round(rng.lognormal(3.5, 1.0, items), 2)
+    sales_day = rng.integers(0, 365, rows)
+    sales_month = pd.Timestamp(str(YEAR)) + pd.to_timedelta(sales_day, unit='D')
+    rate = exchange_rates['Tasso di cambio medio'].to_numpy()[
+        (sales_scenario * periods + (sales_month.month - 1 if dated_rates else 0)) * currencies +
+        customers_frame['Valuta'].to_numpy()[sales_customer] - 1]
+    sales = pd.DataFrame({
+        'Nr. movimento': np.arange(1, rows + 1),
+        'budget/cons': _labels(scenario_labels, sales_scenario),
+        'Tipo movimento': _labels(np.array(['Vendita'], dtype=object), np.zeros(rows, dtype=int)),
+        'Nr articolo': _labels(item_codes, sales_item),
+        'Tipo origine': _labels(np.array(['Cliente'], dtype=object), np.zeros(rows, dtype=int)),
+        'Nr. origine': _labels(customer_codes, sales_customer),
+        'Quantità': quantity,
+        'Importo vendita in valuta locale (TOTALE VENDITA)': np.round(
+            quantity * list_price[sales_item] * rate * rng.normal(1.0, 0.08, rows), 2),
+    })
+    if dated_rates:
+        sales.insert(1, INVOICE_DATE, sales_month)
+
+    # Costi orari: ogni area usa un sottoinsieme delle risorse, a consuntivo i costi crescono in media del 15%
+    area_codes = np.array(['A' + str(10 * (area + 1)) for area in range(areas)], dtype=object)
+    resource_codes = _codes('RIS', resources, 1)
+    pairs = [(resource, area) for area in range(areas)
+             for resource in rng.choice(resources, min(resources, rng.integers(3, 8)), replace=False)]
+    pair_resource, pair_area = (np.array(values) for values in zip(*pairs))
+    hourly_cost = np.round(rng.uniform(40, 80, len(pairs)) * 2) / 2
+    costs = {}
+    for scenario in scenarios:
+        factor = 1.0 if scenario == 'budget' else rng.normal(1.15, 0.03, len(pairs))
+        costs[cost_source(scenario)] = pd.DataFrame({
+            'Risorsa': resource_codes[pair_resource],
+            'Area di produzione': area_codes[pair_area],
+            'Costo orario (€/h)': np.round(hourly_cost * factor * 2) / 2,
+        })
+
+    # Ordini di produzione: articolo e scenario sono quelli dell'ordine, impiego risorse e consumi ne fanno parte
+    usage_rows = int(rows * USAGE_RATIO)
+    orders = max(1, usage_rows // ROWS_PER_ORDER)
+    order_codes = _codes('ODP-', orders, 7)
+    order_item = rng.choice(items, orders, p=item_weights)
+    order_scenario = rng.integers(0, len(scenarios), orders)
+
+    usage_order = rng.integers(0, orders, usage_rows)
+    usage_pair = rng.integers(0, len(pairs), usage_rows)
+    descriptions = np.array([AREA_DESCRIPTIONS[area % len(AREA_DESCRIPTIONS)] for area in range(areas)], dtype=object)
+    resource_usage = pd.DataFrame({
+        'nr articolo': _labels(item_codes, order_item[usage_order]),
+        'budget/consuntivo': _labels(scenario_labels, order_scenario[usage_order]),
+        'Nr. Ordine di produzione': _labels(order_codes, usage_order),
+        'Descrizione': _labels(descriptions, pair_area[usage_pair]),
+        'Nr. Area di produzione': _labels(area_codes, pair_area[usage_pair]),
+        'Risorsa': _labels(resource_codes, pair_resource[usage_pair]),
+        'Tempo risorsa': np.round(rng.gamma(2.0, 0.75, usage_rows) * 4) / 4,
+        'Quantità di output': rng.integers(1, 20, usage_rows).astype(float),
+    })
+
+    # Consumi di materie prime
+    consumption_rows = int(rows * CONSUMPTION_RATIO)
+    consumption_order = rng.integers(0, orders, consumption_rows)
+    raw_material = rng.integers(0, raw_materials, consumption_rows)
+    raw_material_price = np.round(rng.lognormal(2.5, 1.0, raw_materials), 2)
+    raw_material_quantity = np.round(rng.gamma(1.5, 2.0, consumption_rows), 2)
+    raw_materials_usage = pd.DataFrame({
+        'Nr. movimento': np.arange(1, consumption_rows + 1),
+        'Budget/cons': _labels(scenario_labels, order_scenario[consumption_order]),
+        'Tipo movimento': _labels(np.array(['Consumo'], dtype=object), np.zeros(consumption_rows, dtype=int)),
+        'Codice MP': _labels(_codes('MP', raw_materials, 7), raw_material),
+        'Tipo origine': _labels(np.array(['Articolo'], dtype=object), np.zeros(consumption_rows, dtype=int)),
+        'Nr articolo': _labels(item_codes, order_item[consumption_order]),
+        'Nr. documento': _labels(order_codes, consumption_order),
+        'Quantità MP impiegata': raw_material_quantity,
+        'Importo costo (TOTALE)': np.round(
+            raw_material_quantity * raw_material_price[raw_material] * rng.normal(1.0, 0.05, consumption_rows), 2),
+    })
+
+    return {
+        'sales': sales,
+        'customers': customers_frame,
+        'exchange_rates': exchange_rates,
+        'resource_usage': resource_usage,
+        'raw_materials_usage': raw_materials_usage,
+        **costs,
+    }
+
+
+def write(dataset: dict, path: str, file_format: str = 'parquet'):
+    # Stessi nomi dei file originali: la cartella si usa come --path di analysis.py
+    os.makedirs(path, exist_ok=True)
+    stems = {name: COSTS_PREFIX + scenario for scenario, name in cost_sources(dataset).items()}
+    stems.update({name: os.path.splitext(file)[0] for name, file in SOURCES.items()})
+    for name, frame in dataset.items():
+        stem = stems[name]
+        if file_format == 'parquet':
+            frame.to_parquet(path + stem + ".parquet", index=False)
+        elif file_format == 'csv':
+            frame.to_csv(path + stem + ".csv", index=False, **CSV_OPTIONS)
+        else:
+            if len(frame) > XLSX_MAX_ROWS:
+                raise ValueError(f"{stem}: {len(frame)} righe superano il limite di un foglio xlsx")
+            frame.to_excel(path + stem + ".xlsx", index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera dati sintetici con lo schema dei file di input")
+    parser.add_argument("path", help="cartella in cui scrivere i file")
+    parser.add_argument("--rows", type=int, default=10_000, help="righe di vendita (impiego e consumi in proporzione)")
+    parser.add_argument("--items", type=int, default=500)
+    parser.add_argument("--customers", type=int, default=100)
+    parser.add_argument("--currencies", type=int, default=3)
+    parser.add_argument("--areas", type=int, default=10)
+    parser.add_argument("--resources", type=int, default=15)
+    parser.add_argument("--raw-materials", type=int, default=700)
+    parser.add_argument("--scenarios", nargs="+", default=['budget', 'consuntivo'],
+                        help="scenari da generare (es. budget \"forecast 1\" consuntivo)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", choices=FORMATS, default='parquet')
+    parser.add_argument("--dated-rates", action="store_true",
+                        help="tassi di cambio mensili e vendite con la data di registrazione")
+    args = parser.parse_args()
+
+    write(generate(args.rows, args.items, args.customers, args.currencies, args.areas, args.resources,
+                   args.raw_materials, tuple(scenario.lower() for scenario in args.scenarios), args.seed,
+                   args.dated_rates),
+          os.path.join(args.path, ''), args.format)
@@ -1,138 +1,93 @@
 from items import getItem
+from dataset import load_dataset
+from export import export_results
+import numpy as np
 import pandas as pd
 
+UNIT_COLUMNS = ['Prezzo unitario (€/u)', 'Costo unitario (€/u)',
+                'Costo unitario MP (€/u)', 'Costo unitario risorse (€/u)']
+ROWS = ['Ricavi', 'Costi totali', 'Costi MP', 'Costi risorse']
+LEVELS = ['Budget', 'Mix standard', 'Mix effettivo', 'Consuntivo']
 
-def variance_analysis():
-    budget_items = getItem(False)
-    final_items = getItem(True)
-
-    budget_volume = int(budget_items[['Quantità']].sum())
-    final_volume = int(final_items[['Quantità']].sum())
-
-    # Budget
-    budget_price = (budget_items['Prezzo unitario (€/u)']
-                    * budget_items['Quantità']).sum()
-    budget_cost = (budget_items['Costo unitario (€/u)']
-                   * budget_items['Quantità']).sum()
-    budget_raw_materials_cost = (
-        budget_items['Costo unitario MP (€/u)'] * budget_items['Quantità']).sum()
-    budget_resources_cost = (budget_items['Costo unitario risorse (€/u)'] *
-                             budget_items['Quantità']).sum()
-
-    # Standard Mix
-    standard_mix_items = budget_items[
-        ['Nr articolo',
-         'Prezzo unitario (€/u)',
-         'Costo unitario (€/u)',
-         'Costo unitario MP (€/u)',
-         'Costo unitario risorse (€/u)',
-         'Mix (%)']
-    ].merge(final_items[
-        ['Nr articolo',
-         'Quantità']
-    ], how="left", on=['Nr articolo'])
-
-    standard_mix_price = (standard_mix_items['Prezzo unitario (€/u)'] *
-                          standard_mix_items['Mix (%)'] * final_volume).sum()
-    standard_mix_cost = (standard_mix_items['Costo unitario (€/u)']
-                         * standard_mix_items['Mix (%)'] * final_volume).sum()
-    standard_raw_materials_cost = (
-        standard_mix_items['Costo unitario MP (€/u)'] * standard_mix_items['Mix (%)'] * final_volume).sum()
-    standard_resources_cost = (
-        standard_mix_items['Costo unitario risorse (€/u)'] * standard_mix_items['Mix (%)'] * final_volume).sum()
-
-    # Actual Mix
-
-    actual_mix_items = budget_items[
-        ['Nr articolo',
-         'Prezzo unitario (€/u)',
-         'Costo unitario (€/u)',
-         'Costo unitario MP (€/u)',
-         'Costo unitario risorse (€/u)']
-    ].merge(final_items[
-        ['Nr articolo',
-         'Quantità',
-         'Mix (%)']
-    ], how="left", on=['Nr articolo'])
-
-    actual_mix_price = (
-        actual_mix_items['Prezzo unitario (€/u)'] * actual_mix_items['Quantità']).sum()
-    actual_mix_cost = (
-        actual_mix_items['Costo unitario (€/u)'] * actual_mix_items['Quantità']).sum()
-    actual_raw_materials_cost = (
-        actual_mix_items['Costo unitario MP (€/u)'] * actual_mix_items['Mix (%)'] * final_volume).sum()
-    actual_resources_cost = (
-        actual_mix_items['Costo unitario risorse (€/u)'] * actual_mix_items['Mix (%)'] * final_volume).sum()
-
-    # Final
-    final_price = (final_items['Prezzo unitario (€/u)']
-                   * final_items['Quantità']).sum()
-    final_cost = (final_items['Costo unitario (€/u)']
-                  * final_items['Quantità']).sum()
-    final_raw_materials_cost = (
-        final_items['Costo unitario MP (€/u)'] * final_items['Quantità']).sum()
-    final_resources_cost = (final_items['Costo unitario risorse (€/u)'] *
-                            final_items['Quantità']).sum()
-
-    scostamento_totale = pd.DataFrame({
-        'Budget': [
-            budget_price,
-            budget_cost,
-            budget_raw_materials_cost,
-            budget_resources_cost,
-            budget_price - budget_cost
-        ],
-        'Δ B-MS': [
-            standard_mix_price - budget_price,
-            standard_mix_cost - budget_cost,
-            standard_raw_materials_cost - budget_raw_materials_cost,
-            standard_resources_cost - budget_resources_cost,
-            (standard_mix_price - standard_mix_cost) -
-            (budget_price - budget_cost)
-        ],
-        'Mix standard': [
-            standard_mix_price,
-            standard_mix_cost,
-            standard_raw_materials_cost,
-            standard_resources_cost,
-            standard_mix_price - standard_mix_cost
-        ],
-        'Δ MS-ME': [
-            actual_mix_price - standard_mix_price,
-            actual_mix_cost - standard_mix_cost,
-            actual_raw_materials_cost - standard_raw_materials_cost,
-            actual_resources_cost - standard_resources_cost,
-            (actual_mix_price - actual_mix_cost) -
-            (standard_mix_price - standard_mix_cost)
-        ],
-        'Mix effettivo': [
-            actual_mix_price,
-            actual_mix_cost,
-            actual_raw_materials_cost,
-            actual_resources_cost,
-            actual_mix_price - actual_mix_cost
-        ],
-        'Δ ME-C': [
-            final_price - actual_mix_price,
-            final_cost - actual_mix_cost,
-            final_raw_materials_cost - actual_raw_materials_cost,
-            final_resources_cost - actual_resources_cost,
-            (final_price - final_cost) - (actual_mix_price - actual_mix_cost)
-        ],
-        'Consuntivo': [
-            final_price,
-            final_cost,
-            final_raw_materials_cost,
-            final_resources_cost,
-            final_price - final_cost
-        ],
-    }, index=['Ricavi', 'Costi totali', 'Costi MP', 'Costi risorse', 'MOL'])
-
-    scostamento_totale.to_excel("export/scostamento_totale.xlsx")
-
-    print("Scostamento totale MOL: " + str((final_price -
-                                            final_cost) - (budget_price - budget_cost)))
+# Scostamento -> (livello di partenza, livello di arrivo)
+DELTAS = {
+    'Δ B-MS': ('Budget', 'Mix standard'),
+    'Δ MS-ME': ('Mix standard', 'Mix effettivo'),
+    'Δ ME-C': ('Mix effettivo', 'Consuntivo'),
+}
+
+
+def variance_bridge(budget_items: pd.DataFrame, final_items: pd.DataFrame) -> tuple:
+    # Budget e consuntivo allineati sugli stessi articoli (unione)
+    budget = budget_items.set_index('Nr articolo')
+    final = final_items.set_index('Nr articolo')
+    items = budget.index.union(final.index)
+    budget = budget.reindex(items)
+    final = final.reindex(items)
+
+    final_volume = int(final_items['Quantità'].sum())
+
+    # Valori unitari (articoli x voci) e quantità (articoli) di ogni livello:
+    # - Budget: valori e quantità a budget
+    # - Mix standard: valori a budget, volume a consuntivo ripartito con il mix a budget
+    # - Mix effettivo: valori a budget, quantità a consuntivo
+    # - Consuntivo: valori e quantità a consuntivo
+    budget_units = budget[UNIT_COLUMNS].to_numpy(dtype=float)
+    final_units = final[UNIT_COLUMNS].to_numpy(dtype=float)
+    units = np.stack([budget_units, budget_units, budget_units, final_units])
+    quantities = np.stack([
+        budget['Quantità'].to_numpy(dtype=float),
+        budget['Mix (%)'].to_numpy(dtype=float) * final_volume,
+        final['Quantità'].to_numpy(dtype=float),
+        final['Quantità'].to_numpy(dtype=float),
+    ])
+
+    # Contributo di ogni articolo ad ogni voce di ogni livello (livelli x articoli x voci):
+    # i NaN (articolo assente in uno scenario) non contribuiscono, come nella somma di Pandas
+    contributions = units * quantities[:, :, None]
+    contributions[np.isnan(contributions)] = 0.0
+    totals = contributions.sum(axis=1)
+
+    # MOL = Ricavi - Costi totali
+    contributions = np.concatenate([contributions, contributions[:, :, :1] - contributions[:, :, 1:2]], axis=2)
+    totals = np.concatenate([totals, totals[:, :1] - totals[:, 1:2]], axis=1)
+
+    rows = ROWS + ['MOL']
+    level = {name: position for position, name in enumerate(LEVELS)}
+
+    scostamento_totale = pd.DataFrame(index=rows)
+    for name in LEVELS:
+        scostamento_totale[name] = totals[level[name]]
+    for name, (start, end) in DELTAS.items():
+        scostamento_totale.insert(scostamento_totale.columns.get_loc(end), name,
+                                  totals[level[end]] - totals[level[start]])
+
+    contributi_articolo = pd.concat({
+        name: pd.DataFrame(contributions[level[end]] - contributions[level[start]], index=items, columns=rows)
+        for name, (start, end) in DELTAS.items()
+    }, axis=1)
+
+    return scostamento_totale, contributi_articolo
+
+
+def variance_analysis(dataset: dict = None, budget_items: pd.DataFrame = None, final_items: pd.DataFrame = None,
+        base: str = 'budget', target: str = 'consuntivo') -> pd.DataFrame:
+    if dataset is None and (budget_items is None or final_items is None):
+        dataset = load_dataset()
+
+    if budget_items is None:
+        budget_items = getItem(base, dataset)
+    if final_items is None:
+        final_items = getItem(target, dataset)
+
+    scostamento_totale, _ = variance_bridge(budget_items, final_items)
+    return scostamento_totale
 
 
 if __name__ == "__main__":
-    variance_analysis()
+    scostamento_totale = variance_analysis()
+
+    print("Scostamento totale MOL: " + str(
+        scostamento_totale['Consuntivo']['MOL'] - scostamento_totale['Budget']['MOL']))
+
+    export_results({'scostamento_totale': scostamento_totale})
@@ -1,52 +1,69 @@
 import pandas as pd
 from items import getItem
+from dataset import load_dataset
+from export import export_results
 
-budget_items = getItem(False)[
-    ['Nr articolo',
-     'Quantità',
-     'Mix (%)',
-     'Prezzo unitario (€/u)',
-     'Costo unitario MP (€/u)',
-     'Costo unitario risorse (€/u)']
-].rename(columns={'Quantità': 'Quantità budget', 'Mix (%)': 'Mix budget (%)'})
-final_items = getItem(True)[
-    ['Nr articolo',
-     'Quantità',
-     'Mix (%)',
-     'Prezzo unitario (€/u)',
-     'Costo unitario MP (€/u)',
-     'Costo unitario risorse (€/u)']
-].rename(columns={'Quantità': 'Quantità consuntivo', 'Mix (%)': 'Mix consuntivo (%)'})
-
-budget_items['Prezzo totale budget (€)'] = budget_items['Prezzo unitario (€/u)'] * \
-    budget_items['Quantità budget']
-budget_items['Costo totale MP budget (€)'] = budget_items['Costo unitario MP (€/u)'] * \
-    budget_items['Quantità budget']
-budget_items['Costo totale risorse budget (€)'] = budget_items['Costo unitario risorse (€/u)'] * \
-    budget_items['Quantità budget']
-
-final_items['Prezzo totale consuntivo (€)'] = final_items['Prezzo unitario (€/u)'] * \
-    final_items['Quantità consuntivo']
-final_items['Costo totale MP consuntivo (€)'] = final_items['Costo unitario MP (€/u)'] * \
-    final_items['Quantità consuntivo']
-final_items['Costo totale risorse consuntivo (€)'] = final_items['Costo unitario risorse (€/u)'] * \
-    final_items['Quantità consuntivo']
-
-scostamento_volume_per_articolo = budget_items[
-    ['Nr articolo',
-     'Quantità budget',
-     'Mix budget (%)',
-     'Prezzo totale budget (€)',
-     'Costo totale MP budget (€)',
-     'Costo totale risorse budget (€)']
-].merge(final_items[
-    ['Nr articolo',
-     'Quantità consuntivo',
-     'Mix consuntivo (%)',
-     'Prezzo totale consuntivo (€)',
-     'Costo totale MP consuntivo (€)',
-     'Costo totale risorse consuntivo (€)']
-], how="outer", on=['Nr articolo']).sort_values(
-    by=['Quantità consuntivo'], ascending=False)
-
-scostamento_volume_per_articolo.to_excel("export/scostamento_volume_mix_articolo.xlsx")
+
+def volume_deviation_analysis_per_item(dataset: dict = None, budget_items: pd.DataFrame = None, final_items: pd.DataFrame = None,
+        base: str = 'budget', target: str = 'consuntivo') -> pd.DataFrame:
+    if dataset is None and (budget_items is None or final_items is None):
+        dataset = load_dataset()
+
+    if budget_items is None:
+        budget_items = getItem(base, dataset)
+    if final_items is None:
+        final_items = getItem(target, dataset)
+
+    budget_items = budget_items[
+        ['Nr articolo',
+         'Quantità',
+         'Mix (%)',
+         'Prezzo unitario (€/u)',
+         'Costo unitario MP (€/u)',
+         'Costo unitario risorse (€/u)']
+    ].rename(columns={'Quantità': 'Quantità budget', 'Mix (%)': 'Mix budget (%)'})
+    final_items = final_items[
+        ['Nr articolo',
+         'Quantità',
+         'Mix (%)',
+         'Prezzo unitario (€/u)',
+         'Costo unitario MP (€/u)',
+         'Costo unitario risorse (€/u)']
+    ].rename(columns={'Quantità': 'Quantità consuntivo', 'Mix (%)': 'Mix consuntivo (%)'})
+
+    budget_items['Prezzo totale budget (€)'] = budget_items['Prezzo unitario (€/u)'] * \
+        budget_items['Quantità budget']
+    budget_items['Costo totale MP budget (€)'] = budget_items['Costo unitario MP (€/u)'] * \
+        budget_items['Quantità budget']
+    budget_items['Costo totale risorse budget (€)'] = budget_items['Costo unitario risorse (€/u)'] * \
+        budget_items['Quantità budget']
+
+    final_items['Prezzo totale consuntivo (€)'] = final_items['Prezzo unitario (€/u)'] * \
+        final_items['Quantità consuntivo']
+    final_items['Costo totale MP consuntivo (€)'] = final_items['Costo unitario MP (€/u)'] * \
+        final_items['Quantità consuntivo']
+    final_items['Costo totale risorse consuntivo (€)'] = final_items['Costo unitario risorse (€/u)'] * \
+        final_items['Quantità consuntivo']
+
+    scostamento_volume_per_articolo = budget_items[
+        ['Nr articolo',
+         'Quantità budget',
+         'Mix budget (%)',
+         'Prezzo totale budget (€)',
+         'Costo totale MP budget (€)',
+         'Costo totale risorse budget (€)']
+    ].merge(final_items[
+        ['Nr articolo',
+         'Quantità consuntivo',
+         'Mix consuntivo (%)',
+         'Prezzo totale consuntivo (€)',
+         'Costo totale MP consuntivo (€)',
+         'Costo totale risorse consuntivo (€)']
+    ], how="outer", on=['Nr articolo']).sort_values(
+        by=['Quantità consuntivo'], ascending=False)
+
+    return scostamento_volume_per_articolo
+
+
+if __name__ == "__main__":
+    export_results({'scostamento_volume_mix_articolo': volume_deviation_analysis_per_item()})